@@ -0,0 +1,206 @@
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+from ffmpeg_pool import ffmpeg_pool
+from media_probe import probe_media
+
+logger = logging.getLogger(__name__)
+
+# Boundaries closer than this to a keyframe are treated as on it
+KEYFRAME_TOLERANCE = 0.05
+
+# Settings for re-encoded boundary pieces
+ENCODE_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18']
+AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+
+# ffprobe H.264 profile names -> libx264 profiles
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+# Stream parameters encoded pieces must share with the copied video
+MATCHING_PARAMS = ('codec_name', 'profile', 'level', 'pix_fmt', 'width', 'height')
+
+def parse_time(value) -> float:
+    """Convert HH:MM:SS, MM:SS or plain seconds to seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _run_ffmpeg(args: list, encode: bool) -> None:
+    ffmpeg_pool.run_sync(['ffmpeg', '-v', 'error', '-y'] + args, encode=encode)
+
+def matching_encode_args(video: dict) -> list:
+    """x264 options that reproduce the source stream's parameters.
+
+    The joined clip has a single avcC header, so boundary pieces that
+    differ from the copied video in profile, level or refs make decoders
+    glitch at the joins.
+    """
+    args = ['-pix_fmt', video.get('pix_fmt') or 'yuv420p']
+    profile = X264_PROFILES.get(video.get('profile'))
+    if profile:
+        args += ['-profile:v', profile]
+    if video.get('level') and video['level'] >= 10:
+        args += ['-level:v', f"{video['level'] / 10:.1f}"]
+    if video.get('refs'):
+        args += ['-refs', str(video['refs'])]
+    rate = video.get('frame_rate')
+    if rate and rate != '0/0' and rate == video.get('avg_frame_rate'):
+        # Only constant frame rate sources; forcing a rate on VFR would drop or dup frames
+        args += ['-r', rate]
+    return args
+
+def _encode_piece(source: str, start: float, end: float, output: str, video: dict) -> None:
+    # Input seeking with re-encoding is frame accurate
+    _run_ffmpeg([
+        '-ss', f'{start:.6f}', '-i', source, '-t', f'{end - start:.6f}',
+        '-map', '0:v:0', '-map', '0:a:0?',
+        *ENCODE_ARGS, *matching_encode_args(video), *AUDIO_ARGS,
+        '-bsf:v', 'h264_mp4toannexb', '-f', 'mpegts', output
+    ], encode=True)
+
+def _check_piece(piece: str, video: dict) -> None:
+    """Raise ValueError when an encoded piece cannot be joined with the copied video."""
+    encoded = probe_media(piece)['video'] or {}
+    mismatched = [key for key in MATCHING_PARAMS if encoded.get(key) != video.get(key)]
+    if mismatched:
+        raise ValueError(
+            'Encoded piece does not match the source: ' +
+            ', '.join(f'{key} {encoded.get(key)} != {video.get(key)}' for key in mismatched)
+        )
+
+def _copy_piece(source: str, start: float, end: float, output: str) -> None:
+    # `start` is a keyframe, so stream copy begins exactly there
+    _run_ffmpeg([
+        '-ss', f'{start:.6f}', '-i', source, '-t', f'{end - start:.6f}',
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c:v', 'copy', *AUDIO_ARGS,
+        '-bsf:v', 'h264_mp4toannexb', '-f', 'mpegts', output
+    ], encode=False)
+
+def plan_cut(keyframes: list, start: float, end: float) -> list:
+    """Split [start, end] into ('encode' | 'copy', from, to) pieces.
+
+    Only the partial GOPs before the first and after the last keyframe
+    inside the range get re-encoded; everything in between is copied.
+    """
+    inner = [k for k in keyframes if start - KEYFRAME_TOLERANCE <= k <= end + KEYFRAME_TOLERANCE]
+    if len(inner) < 2:
+        # Range is within a single GOP
+        return [('encode', start, end)]
+
+    first, last = inner[0], inner[-1]
+    pieces = []
+    if first - start > KEYFRAME_TOLERANCE:
+        pieces.append(('encode', start, first))
+    # Otherwise the clip starts on `first` itself: copying from anywhere
+    # else would seek back to the previous keyframe and add a whole GOP
+    if end - last <= KEYFRAME_TOLERANCE:
+        last = end
+    pieces.append(('copy', first, last))
+    if end - last > KEYFRAME_TOLERANCE:
+        pieces.append(('encode', last, end))
+    return pieces
+
+def plan_split(media: dict, file_size: int, max_size: int) -> list:
+    """Split a file into [from, to] parts of at most about `max_size` bytes.
+
+    Parts end on keyframes so they can be stream copied cleanly. Sizes are
+    estimated from the average bitrate, with some headroom for variation.
+    A GOP longer than a part stays whole rather than being cut mid-GOP.
+    """
+    duration = media['duration']
+    keyframes = media.get('keyframes') or []
+    if file_size <= max_size or duration <= 0:
+        return [[0.0, duration]]
+    part_length = duration * max_size / file_size * 0.9
+
+    parts = []
+    start = 0.0
+    while start < duration:
+        end = start + part_length
+        if end < duration and keyframes:
+            # Last keyframe that still keeps the part small enough
+            candidates = [k for k in keyframes if start + KEYFRAME_TOLERANCE < k <= end]
+            later = [k for k in keyframes if k > start + KEYFRAME_TOLERANCE]
+            end = candidates[-1] if candidates else (later[0] if later else duration)
+        if duration - end <= KEYFRAME_TOLERANCE:
+            # Never leave a sliver behind: the last part runs to the end
+            end = duration
+        parts.append([start, end])
+        start = end
+    return parts
+
+def full_reencode(source: str, start: float, end: float, output: str) -> None:
+    """Re-encode the whole range, used when smart cutting is not possible."""
+    _run_ffmpeg([
+        '-ss', f'{start:.6f}', '-i', source, '-t', f'{end - start:.6f}',
+        *ENCODE_ARGS, *AUDIO_ARGS, '-movflags', '+faststart', output
+    ], encode=True)
+
+def smart_cut(source: str, start_time=None, end_time=None, output: str = None) -> str:
+    """Cut a frame accurate clip, re-encoding only the boundary GOPs.
+
+    Without `output` the source is replaced by the clip. Returns the clip path.
+    """
+    info = probe_media(source)
+    start = parse_time(start_time) if start_time else 0.0
+    end = min(parse_time(end_time), info['duration']) if end_time else info['duration']
+    if end <= start:
+        raise ValueError(f'Clip end ({end}s) must be after its start ({start}s)')
+
+    in_place = output is None
+    target = os.path.splitext(source)[0] + '.clip.mp4' if in_place else output
+    video = info['video']
+
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        if not video or video.get('codec_name') != 'h264':
+            # Boundary pieces could not be joined with copied non-H.264 video
+            full_reencode(source, start, end, target)
+        else:
+            try:
+                pieces = plan_cut(info['keyframes'], start, end)
+                list_file = os.path.join(work_dir, 'pieces.txt')
+                with open(list_file, 'w') as f:
+                    for i, (mode, piece_start, piece_end) in enumerate(pieces):
+                        piece = os.path.join(work_dir, f'piece{i}.ts')
+                        if mode == 'copy':
+                            _copy_piece(source, piece_start, piece_end, piece)
+                        else:
+                            _encode_piece(source, piece_start, piece_end, piece, video)
+                            _check_piece(piece, video)
+                        f.write(f"file '{piece}'\n")
+                timescale = []
+                if (video.get('time_base') or '').startswith('1/'):
+                    # Keep the source's timebase instead of the muxer default
+                    timescale = ['-video_track_timescale', video['time_base'][2:]]
+                _run_ffmpeg([
+                    '-f', 'concat', '-safe', '0', '-i', list_file,
+                    '-c', 'copy', '-bsf:a', 'aac_adtstoasc', *timescale, '-movflags', '+faststart', target
+                ], encode=False)
+            except (subprocess.CalledProcessError, ValueError) as e:
+                logger.warning(f"Smart cut failed, re-encoding the whole clip: {getattr(e, 'stderr', None) or e}")
+                full_reencode(source, start, end, target)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if in_place:
+        # The clip is always an mp4, whatever container the source used
+        final = os.path.splitext(source)[0] + '.mp4'
+        os.replace(target, final)
+        if final != source:
+            os.remove(source)
+        return final
+    return target
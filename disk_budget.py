@@ -0,0 +1,133 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Estimates are rough, keep some slack on top of them
+SAFETY_MARGIN = 1.2
+
+# Used when neither a size nor a bitrate is known
+UNKNOWN_SIZE_GUESS = 300 * 1024 * 1024
+
+def estimate_footprint(size: int, needs_transcode: bool, split_threshold: int,
+                       clip_fraction: float = None) -> int:
+    """Estimate the peak disk usage of a job, in bytes.
+
+    Accounts for the downloaded source, the converted mp4 written next to
+    it, the smart-cut pieces of a clip and the split parts, which are all
+    written before the first one is sent.
+    """
+    size = size or UNKNOWN_SIZE_GUESS
+    peak = size
+    if needs_transcode:
+        peak += size
+    output = size if clip_fraction is None else size * clip_fraction
+    if clip_fraction is not None:
+        # Pieces plus the joined clip, while the source still exists
+        peak = max(peak, size + 2 * output)
+    if output > split_threshold:
+        peak = max(peak, 2 * output)
+    return int(peak * SAFETY_MARGIN)
+
+def dir_size(path: str) -> int:
+    """Total size of the files below a folder."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class DiskBudget:
+    """Reserve disk space for jobs before they start writing.
+
+    Each reservation is tied to the folder the job writes to. Whatever is
+    already in that folder counts against the reservation, so space is not
+    counted twice while a download fills it up.
+    """
+
+    def __init__(self, path: str, headroom: int = 512 * 1024 * 1024):
+        self.path = path
+        self.headroom = headroom
+        self.reservations = {}  # key -> (bytes, folder)
+        self._changed = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def _measure(self, folders: dict) -> dict:
+        os.makedirs(self.path, exist_ok=True)
+        return {
+            'free': shutil.disk_usage(self.path).free,
+            'written': {key: dir_size(folder) for key, folder in folders.items()},
+        }
+
+    async def measure(self) -> dict:
+        """Free space and what each reserved folder already holds, scanned off the event loop.
+
+        Pass the result to available() / try_reserve() to make several
+        decisions from one scan.
+        """
+        folders = {key: folder for key, (_, folder) in self.reservations.items()}
+        return await asyncio.to_thread(self._measure, folders)
+
+    def available(self, usage: dict = None) -> int:
+        """Bytes that can still be promised to new jobs.
+
+        Without `usage` from measure() the disk is scanned here, which blocks.
+        """
+        if usage is None:
+            usage = self._measure({key: folder for key, (_, folder) in self.reservations.items()})
+        # Reservations made after the scan count in full
+        outstanding = sum(
+            max(0, nbytes - usage['written'].get(key, 0)) for key, (nbytes, _) in self.reservations.items()
+        )
+        return usage['free'] - outstanding - self.headroom
+
+    def try_reserve(self, key: str, nbytes: int, folder: str, usage: dict = None) -> bool:
+        """Reserve space right away if it is available."""
+        if nbytes > self.available(usage):
+            return False
+        self.reservations[key] = (nbytes, folder)
+        logger.info(f"Reserved {nbytes/(1024*1024):.0f}MB in {self.path} for {key}")
+        return True
+
+    async def reserve(self, key: str, nbytes: int, folder: str, timeout: float = None) -> bool:
+        """Wait until the space can be reserved; False if the timeout passes first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = self._condition()
+        async with changed:
+            while not self.try_reserve(key, nbytes, folder, await self.measure()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # Other processes can free space too, so re-check periodically
+                wait = 5 if remaining is None else min(5, remaining)
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        return True
+
+    async def resize(self, key: str, nbytes: int) -> None:
+        """Shrink (or grow) a reservation once a stage finished and real sizes are known."""
+        if key in self.reservations:
+            self.reservations[key] = (nbytes, self.reservations[key][1])
+            await self._notify()
+
+    async def release(self, key: str) -> None:
+        """Drop a reservation and wake up queued jobs."""
+        if self.reservations.pop(key, None) is not None:
+            await self._notify()
+
+    async def _notify(self) -> None:
+        changed = self._condition()
+        async with changed:
+            changed.notify_all()
@@ -0,0 +1,165 @@
+import os
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from profiler import span, is_profiling, parse_ffmpeg_benchmark
+
+logger = logging.getLogger(__name__)
+
+class FFmpegPool:
+    """One ffmpeg/ffprobe execution service shared by every stage of the bot.
+
+    Encodes are limited so that together they use about `cpu_budget` cores,
+    each getting `threads_per_encode` threads. Copy operations (remux,
+    stream-copy splits, probes) are cheap and have their own, larger limit,
+    so they never queue behind encodes. Both threads (download workers) and
+    coroutines (the bot) can use the pool.
+    """
+
+    def __init__(self, cpu_budget: int = None, threads_per_encode: int = None, max_copies: int = None):
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.threads_per_encode = threads_per_encode or max(1, min(4, self.cpu_budget // 2))
+        self.max_encodes = max(1, self.cpu_budget // self.threads_per_encode)
+        self.max_copies = max_copies or 2 * self.cpu_budget
+        self._lock = threading.Lock()
+        self._running = {True: 0, False: 0}
+        self._waiters = deque()  # [encode, wake]
+
+    def _limit(self, encode: bool) -> int:
+        return self.max_encodes if encode else self.max_copies
+
+    def queue_length(self, encode: bool = None) -> int:
+        """Number of ffmpeg runs waiting for a slot (optionally only encodes or copies)."""
+        with self._lock:
+            return sum(1 for w in self._waiters if encode is None or w[0] == encode)
+
+    def running(self) -> dict:
+        with self._lock:
+            return {'encodes': self._running[True], 'copies': self._running[False]}
+
+    def _try_take(self, encode: bool) -> bool:
+        # Called with the lock held; first come, first served per kind
+        if any(w[0] == encode for w in self._waiters):
+            return False
+        if self._running[encode] >= self._limit(encode):
+            return False
+        self._running[encode] += 1
+        return True
+
+    def _release(self, encode: bool) -> None:
+        with self._lock:
+            self._running[encode] -= 1
+            for waiter in self._waiters:
+                if waiter[0] == encode:
+                    self._waiters.remove(waiter)
+                    self._running[encode] += 1
+                    waiter[1]()
+                    break
+
+    def _acquire_sync(self, encode: bool) -> None:
+        event = threading.Event()
+        with self._lock:
+            if self._try_take(encode):
+                return
+            self._waiters.append([encode, event.set])
+        event.wait()
+
+    async def _acquire(self, encode: bool) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            if self._try_take(encode):
+                return
+            waiter = [encode, wake]
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self._release(encode)
+            raise
+
+    def _command(self, cmd: list, encode: bool) -> list:
+        if encode and cmd[0] == 'ffmpeg':
+            # Thread options must precede the output file, which comes last
+            cmd = cmd[:-1] + ['-threads', str(self.threads_per_encode), cmd[-1]]
+        if cmd[0] == 'ffmpeg' and is_profiling():
+            # Makes ffmpeg report its own CPU time for the job profile. The
+            # report is logged at info level, so quieter -v settings are dropped
+            args = []
+            rest = iter(cmd[1:])
+            for arg in rest:
+                if arg in ('-v', '-loglevel'):
+                    next(rest, None)
+                else:
+                    args.append(arg)
+            cmd = [cmd[0], '-benchmark', '-nostats', '-v', 'info'] + args
+        return cmd
+
+    def _span_name(self, cmd: list, encode: bool) -> str:
+        return f"{cmd[0]} {'encode' if encode else 'copy'}"
+
+    async def run(self, cmd: list, encode: bool = False) -> str:
+        """Run ffmpeg/ffprobe without blocking the event loop; returns stdout.
+
+        Raises subprocess.CalledProcessError when the command fails.
+        """
+        with span('ffmpeg slot wait', encode=encode):
+            await self._acquire(encode)
+        try:
+            cmd = self._command(cmd, encode)
+            with span(self._span_name(cmd, encode), cmd=' '.join(cmd)) as args:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    stdout, stderr = await process.communicate()
+                except asyncio.CancelledError:
+                    process.kill()
+                    await process.wait()
+                    raise
+                stdout, stderr = stdout.decode(errors='replace'), stderr.decode(errors='replace')
+                parse_ffmpeg_benchmark(stderr, args)
+        finally:
+            self._release(encode)
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+        return stdout
+
+    def run_sync(self, cmd: list, encode: bool = False) -> str:
+        """Blocking variant of run() for worker threads; returns stdout."""
+        with span('ffmpeg slot wait', encode=encode):
+            self._acquire_sync(encode)
+        try:
+            cmd = self._command(cmd, encode)
+            with span(self._span_name(cmd, encode), cmd=' '.join(cmd)) as args:
+                result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+                parse_ffmpeg_benchmark(result.stderr, args)
+        finally:
+            self._release(encode)
+
+        if result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        return result.stdout
+
+def _env_int(name: str):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+# Shared by the bot, the downloader and the clipper
+ffmpeg_pool = FFmpegPool(
+    cpu_budget=_env_int('FFMPEG_CPU_BUDGET'),
+    threads_per_encode=_env_int('FFMPEG_THREADS_PER_ENCODE'),
+)
@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import OrderedDict
+from video_downloader import get_video_info
+from profiler import span
+
+# How long an extracted index stays valid, and how many videos we keep
+INDEX_TTL = 30 * 60
+INDEX_CACHE_SIZE = 64
+
+# url -> (created_at, index); used from several worker threads
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+# url -> Event set when the running extraction of that url ends
+_in_flight = {}
+
+def _format_size(f: dict, duration: float):
+    """Return (size_in_bytes, is_estimate) for a format."""
+    if f.get('filesize'):
+        return f['filesize'], False
+    if f.get('filesize_approx'):
+        return f['filesize_approx'], True
+    # tbr is in kbit/s
+    if f.get('tbr') and duration:
+        return int(f['tbr'] * 1000 / 8 * duration), True
+    return None, True
+
+def _video_needs_transcode(f: dict) -> bool:
+    """Whether download_video converts this format after downloading it.
+
+    convert_to_mp4 leaves every mp4 alone, whatever its video codec.
+    """
+    return f.get('ext') != 'mp4'
+
+def build_format_index(info: dict) -> dict:
+    """Build a compact, pre-sorted view of the formats of a video."""
+    duration = info.get('duration')
+    video = []
+    audio = []
+
+    for f in info.get('formats', []):
+        size, estimated = _format_size(f, duration)
+        entry = {
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'note': f.get('format_note', ''),
+            'size': size,
+            'size_estimated': estimated,
+        }
+        if f.get('height'):
+            entry.update({
+                'height': f.get('height'),
+                'fps': f.get('fps'),
+                'vcodec': f.get('vcodec'),
+                'acodec': f.get('acodec'),
+                'has_audio': f.get('acodec') not in (None, 'none'),
+                'needs_transcode': _video_needs_transcode(f),
+            })
+            video.append(entry)
+        elif f.get('abr'):
+            entry.update({
+                'abr': float(f.get('abr')),
+                'acodec': f.get('acodec'),
+                'needs_transcode': f.get('ext') not in ('mp4', 'm4a'),
+            })
+            audio.append(entry)
+
+    return {
+        'title': info.get('title', 'Video'),
+        'duration': duration,
+        'view_count': info.get('view_count'),
+        'video': sorted(video, key=lambda x: x['height'], reverse=True),
+        'audio': sorted(audio, key=lambda x: x['abr'], reverse=True),
+        # First few formats in extractor order, used by /info
+        'summary': [
+            {
+                'ext': f.get('ext'),
+                'res': f.get('height') or f.get('abr') or '',
+                'note': f.get('format_note', ''),
+            }
+            for f in info.get('formats', [])[:5]
+        ],
+    }
+
+def find_format(index: dict, format_id: str = None):
+    """Return the index entry download_video would fetch for `format_id`, if known."""
+    if not format_id or format_id == 'best':
+        # Default download format is the best single file, preferably mp4
+        combined = [f for f in index['video'] if f['has_audio']]
+        return next((f for f in combined if f['ext'] == 'mp4'), combined[0] if combined else None)
+    for f in index['video'] + index['audio']:
+        if f['format_id'] == format_id:
+            return f
+    return None
+
+def _cached_index(url: str):
+    # Called with _index_lock held
+    cached = _index_cache.get(url)
+    if cached and time.time() - cached[0] < INDEX_TTL:
+        _index_cache.move_to_end(url)
+        return cached[1]
+    return None
+
+def get_format_index(url: str) -> dict:
+    """Return the format index of a video, extracting it at most once per TTL.
+
+    Safe to call from several threads; concurrent requests for the same url
+    wait for a single extraction.
+    """
+    while True:
+        with _index_lock:
+            index = _cached_index(url)
+            if index is not None:
+                return index
+            done = _in_flight.get(url)
+            if done is None:
+                done = _in_flight[url] = threading.Event()
+                break
+        # Another thread is extracting this url; if it fails, the next waiter retries
+        done.wait()
+
+    try:
+        # The raw info dict is dropped as soon as the index is built
+        with span('extract info'):
+            index = build_format_index(get_video_info(url))
+        with _index_lock:
+            _index_cache[url] = (time.time(), index)
+            _index_cache.move_to_end(url)
+            while len(_index_cache) > INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+        return index
+    finally:
+        with _index_lock:
+            del _in_flight[url]
+        done.set()
+
+def format_size(size: int) -> str:
+    """Human readable file size."""
+    if size < 1024 * 1024:  # Less than 1MB
+        return f"{size/1024:.1f}KB"
+    return f"{size/(1024*1024):.1f}MB"
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Root folder for all job working directories
+DOWNLOADS_ROOT = os.path.join(os.getcwd(), 'downloads')
+
+# Checkpoints live next to the downloads so a restart can find them
+JOBS_DIR = os.path.join(DOWNLOADS_ROOT, '.jobs')
+
+def job_dir(job: dict) -> str:
+    """Return the working directory of a job."""
+    # Small jobs may have been moved to RAM backed scratch space
+    return job.get('work_dir') or os.path.join(DOWNLOADS_ROOT, job['job_id'])
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f'{job_id}.json')
+
+def save_job(job: dict) -> None:
+    """Write a job checkpoint to disk atomically."""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job['updated_at'] = time.time()
+    path = _job_path(job['job_id'])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+def create_job(chat_id: int, user_id: int, url: str, format_id: str = None,
+               start_time: str = None, end_time: str = None, save: bool = True) -> dict:
+    """Create a new download job, checkpointing it unless `save` is False."""
+    job = {
+        'job_id': uuid.uuid4().hex[:12],
+        'chat_id': chat_id,
+        'user_id': user_id,
+        'url': url,
+        'format_id': format_id,
+        'start_time': start_time,
+        'end_time': end_time,
+        # downloading -> downloaded -> sending
+        'stage': 'downloading',
+        'video_file': None,
+        'work_dir': None,
+        # Stream URLs resolved ahead of the download (see resolve_video)
+        'info_file': None,
+        # ffprobe result of video_file, and [start, end] of each part
+        'media': None,
+        'split_plan': None,
+        'num_parts': None,
+        'delivered_parts': [],
+        'created_at': time.time(),
+    }
+    if save:
+        save_job(job)
+    return job
+
+def update_job(job: dict, **changes) -> None:
+    """Apply changes to a job and checkpoint it."""
+    job.update(changes)
+    save_job(job)
+
+def mark_part_delivered(job: dict, part_num: int) -> None:
+    """Record that a split part reached the user."""
+    if part_num not in job['delivered_parts']:
+        job['delivered_parts'].append(part_num)
+        save_job(job)
+
+def finish_job(job: dict) -> None:
+    """Drop the checkpoint of a job that completed or failed for good."""
+    try:
+        os.remove(_job_path(job['job_id']))
+    except FileNotFoundError:
+        pass
+
+def load_pending_jobs() -> list:
+    """Load every job checkpoint left behind by a previous run."""
+    if not os.path.isdir(JOBS_DIR):
+        return []
+
+    jobs = []
+    for name in os.listdir(JOBS_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(JOBS_DIR, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                jobs.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable job checkpoint {path}: {str(e)}")
+    return sorted(jobs, key=lambda job: job.get('created_at', 0))
@@ -0,0 +1,103 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import contextlib
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Correlation IDs attached to every record logged while a job runs.
+# asyncio.to_thread copies the context, so download threads inherit them.
+job_id_var = contextvars.ContextVar('job_id', default='-')
+user_id_var = contextvars.ContextVar('user_id', default='-')
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [job=%(job_id)s user=%(user_id)s] %(message)s'
+
+_listener = None
+
+class CorrelationFilter(logging.Filter):
+    """Stamp records with the job and user of the current context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job_id = job_id_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+class YtDlpLogger:
+    """Adapter passed to YoutubeDL as `logger`, forwarding to the yt_dlp logger."""
+
+    def __init__(self):
+        self.logger = logging.getLogger('yt_dlp')
+
+    def debug(self, msg: str) -> None:
+        # yt-dlp sends both debug and regular screen output through debug()
+        if msg.startswith('[debug] '):
+            self.logger.debug(msg[len('[debug] '):])
+        else:
+            self.logger.info(msg)
+
+    def info(self, msg: str) -> None:
+        self.logger.info(msg)
+
+    def warning(self, msg: str) -> None:
+        self.logger.warning(msg)
+
+    def error(self, msg: str) -> None:
+        self.logger.error(msg)
+
+def ytdlp_options() -> dict:
+    """YoutubeDL options that route its output through logging at the configured level."""
+    debug = logging.getLogger('yt_dlp').isEnabledFor(logging.DEBUG)
+    return {
+        'logger': YtDlpLogger(),
+        'verbose': debug,
+        'quiet': False,
+        'noprogress': not debug,
+    }
+
+@contextlib.contextmanager
+def log_context(job_id=None, user_id=None):
+    """Attach a job and/or user ID to every record logged inside the block."""
+    tokens = []
+    if job_id is not None:
+        tokens.append((job_id_var, job_id_var.set(str(job_id))))
+    if user_id is not None:
+        tokens.append((user_id_var, user_id_var.set(str(user_id))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+def setup_logging(level: str = None, ytdlp_level: str = None) -> None:
+    """Send all logging through a queue so callers never block on log I/O.
+
+    Levels default to the LOG_LEVEL and YTDLP_LOG_LEVEL environment
+    variables (INFO and WARNING when unset).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    ytdlp_level = ytdlp_level or os.environ.get('YTDLP_LOG_LEVEL', 'WARNING')
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # Runs in the logging thread, where the context variables are set
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level.upper())
+    logging.getLogger('yt_dlp').setLevel(ytdlp_level.upper())
+    # Polling logs every request at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import OrderedDict
+from ffmpeg_pool import ffmpeg_pool
+
+# Probed files are cached by path, mtime and size so a file is probed once
+PROBE_CACHE_SIZE = 32
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+# One ffprobe pass: container, streams and the packet flags we need for keyframes
+PROBE_ENTRIES = (
+    'format=duration,size,bit_rate'
+    ':stream=index,codec_type,codec_name,profile,level,refs,pix_fmt,width,height'
+    ',r_frame_rate,avg_frame_rate,time_base,sample_rate,channels'
+    ':packet=stream_index,pts_time,flags'
+)
+
+def _probe_command(path: str) -> list:
+    return ['ffprobe', '-v', 'error', '-show_entries', PROBE_ENTRIES, '-of', 'compact', path]
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_probe_output(output: str) -> dict:
+    """Turn compact ffprobe output into duration, stream info and keyframe times."""
+    streams = []
+    packets = []
+    container = {}
+    for line in output.splitlines():
+        section, _, rest = line.partition('|')
+        fields = dict(field.partition('=')[::2] for field in rest.split('|') if field)
+        if section == 'packet':
+            if 'K' in fields.get('flags', ''):
+                packets.append((fields.get('stream_index'), fields.get('pts_time')))
+        elif section == 'stream':
+            streams.append(fields)
+        elif section == 'format':
+            container = fields
+
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    keyframes = []
+    if video:
+        keyframes = sorted(
+            t for t in (_number(pts) for index, pts in packets if index == video.get('index'))
+            if t is not None
+        )
+
+    return {
+        'duration': _number(container.get('duration')) or 0.0,
+        'size': _number(container.get('size'), int),
+        'bit_rate': _number(container.get('bit_rate'), int),
+        'video': video and {
+            'codec_name': video.get('codec_name'),
+            'profile': video.get('profile'),
+            'level': _number(video.get('level'), int),
+            'refs': _number(video.get('refs'), int),
+            'pix_fmt': video.get('pix_fmt'),
+            'width': _number(video.get('width'), int),
+            'height': _number(video.get('height'), int),
+            'frame_rate': video.get('r_frame_rate'),
+            'avg_frame_rate': video.get('avg_frame_rate'),
+            'time_base': video.get('time_base'),
+        },
+        'audio': audio and {
+            'codec_name': audio.get('codec_name'),
+            'sample_rate': _number(audio.get('sample_rate'), int),
+            'channels': _number(audio.get('channels'), int),
+        },
+        'keyframes': keyframes,
+    }
+
+def _cache_key(path: str):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def _cache_get(key):
+    with _probe_cache_lock:
+        media = _probe_cache.get(key)
+        if media is not None:
+            _probe_cache.move_to_end(key)
+        return media
+
+def _cache_put(key, media: dict) -> None:
+    with _probe_cache_lock:
+        _probe_cache[key] = media
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+
+def probe_media(path: str) -> dict:
+    """Probe a file once (from a worker thread); later calls hit the cache."""
+    key = _cache_key(path)
+    media = _cache_get(key)
+    if media is None:
+        media = parse_probe_output(ffmpeg_pool.run_sync(_probe_command(path)))
+        media['path'] = path
+        _cache_put(key, media)
+    return media
+
+async def probe_media_async(path: str) -> dict:
+    """Async variant of probe_media for the event loop."""
+    key = _cache_key(path)
+    media = _cache_get(key)
+    if media is None:
+        media = parse_probe_output(await ffmpeg_pool.run(_probe_command(path)))
+        media['path'] = path
+        _cache_put(key, media)
+    return media
+
+# Telegram wants both sides of a thumbnail within 320px; never upscale
+THUMBNAIL_SCALE = (
+    "scale='min(320,iw)':'min(320,ih)'"
+    ':force_original_aspect_ratio=decrease:force_divisible_by=2'
+)
+
+def thumbnail_time(media: dict, start: float = 0.0, end: float = None) -> float:
+    """A keyframe a little into [start, end), skipping the usual black first frame."""
+    end = media['duration'] if end is None else end
+    after = start + min(3.0, (end - start) / 10)
+    return next((k for k in media.get('keyframes') or [] if after <= k < end), start)
+
+async def make_thumbnail(path: str, at: float, output: str):
+    """Grab one frame as a Telegram sized JPEG thumbnail; None if it fails.
+
+    `at` should be a keyframe so only a single frame gets decoded.
+    """
+    try:
+        await ffmpeg_pool.run([
+            'ffmpeg', '-v', 'error', '-y', '-ss', f'{at:.3f}', '-i', path,
+            '-frames:v', '1', '-vf', THUMBNAIL_SCALE, '-q:v', '5', output
+        ])
+    except Exception:
+        return None
+    return output if os.path.exists(output) and os.path.getsize(output) > 0 else None
+
+def video_attributes(media: dict, duration: float = None) -> dict:
+    """send_video arguments so Telegram does not have to process the file itself."""
+    attributes = {'duration': max(1, round(duration if duration is not None else media['duration']))}
+    if media.get('video') and media['video']['width'] and media['video']['height']:
+        attributes['width'] = media['video']['width']
+        attributes['height'] = media['video']['height']
+    return attributes
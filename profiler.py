@@ -0,0 +1,161 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Where traces are written; open *.trace.json in chrome://tracing or
+# https://ui.perfetto.dev and *.folded in https://speedscope.app
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+
+# Profile every job (deployment switch) and/or sample Python stacks
+_state = {
+    'enabled': os.environ.get('PROFILE_JOBS', '').lower() in ('1', 'true', 'yes'),
+    'next': 0,
+}
+SAMPLING = os.environ.get('PROFILE_SAMPLING', '').lower() in ('1', 'true', 'yes')
+SAMPLE_INTERVAL = 0.01
+
+# Profile of the job running in the current context (inherited by to_thread)
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+def set_profiling(enabled: bool) -> None:
+    """Turn profiling of all new jobs on or off."""
+    _state['enabled'] = enabled
+
+def profile_next_jobs(count: int = 1) -> None:
+    """Profile only the next `count` jobs."""
+    _state['next'] += count
+
+def profiling_status() -> str:
+    if _state['enabled']:
+        return 'on for all jobs'
+    if _state['next']:
+        return f"on for the next {_state['next']} job(s)"
+    return 'off'
+
+def should_profile() -> bool:
+    """Decide whether a job that is starting now gets profiled."""
+    if _state['enabled']:
+        return True
+    if _state['next'] > 0:
+        _state['next'] -= 1
+        return True
+    return False
+
+class StackSampler(threading.Thread):
+    """Samples the Python stacks of all threads into folded-stack counts."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+class JobProfile:
+    """Timeline of one job as Chrome trace events."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.origin = time.perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, args: dict = None) -> None:
+        event = {
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+            'args': args or {},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.job_id}.trace.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+@contextlib.contextmanager
+def span(name: str, **args):
+    """Record the wall time of a block in the current job's profile.
+
+    Yields a dict; anything put into it ends up in the event's args.
+    Without an active profile this costs next to nothing.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        profile.add_span(name, start, time.perf_counter(), args)
+
+def is_profiling() -> bool:
+    return current_profile.get() is not None
+
+_BENCH_RE = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+def parse_ffmpeg_benchmark(stderr: str, args: dict) -> None:
+    """Add the child CPU time reported by `ffmpeg -benchmark` to span args."""
+    match = _BENCH_RE.search(stderr or '')
+    if match:
+        args['cpu_user_s'] = float(match.group(1))
+        args['cpu_sys_s'] = float(match.group(2))
+
+@contextlib.contextmanager
+def profile_job(job_id: str, enabled: bool):
+    """Profile everything a job does inside the block and write the trace at the end."""
+    if not enabled:
+        yield
+        return
+
+    profile = JobProfile(job_id)
+    token = current_profile.set(profile)
+    sampler = StackSampler() if SAMPLING else None
+    if sampler:
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span('job', start, time.perf_counter())
+        current_profile.reset(token)
+        try:
+            path = profile.write(PROFILE_DIR)
+            if sampler:
+                # Samples cover every thread, including other jobs running at the same time
+                sampler.stop()
+                folded_path = os.path.join(PROFILE_DIR, f'{job_id}.folded')
+                with open(folded_path, 'w', encoding='utf-8') as f:
+                    for stack, count in sampler.counts.most_common():
+                        f.write(f'{stack} {count}\n')
+            logger.info(f"Wrote job profile to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write job profile: {str(e)}")
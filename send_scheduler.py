@@ -0,0 +1,208 @@
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from telegram.error import RetryAfter, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Lower value goes out first
+PRIORITY_DELIVERY = 0   # videos and final results
+PRIORITY_REPLY = 1      # answers to user commands
+PRIORITY_PROGRESS = 2   # status message edits
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+class SendScheduler:
+    """Central gate for every outbound Telegram call.
+
+    Calls wait for a token from the global bucket and from their chat's
+    bucket; waiters are served by priority, so deliveries overtake
+    progress updates when the bot is close to its limits. A RetryAfter
+    from the API pauses all sending for the requested time.
+    """
+
+    def __init__(self, global_rate: float = 25, chat_rate: float = 1, chat_burst: float = 3,
+                 max_flood_retries: int = 5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_flood_retries = max_flood_retries
+        self._waiters = []  # [priority, seq, chat_id, future]
+        self._seq = 0
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher = None
+        # (chat_id, message_id) -> latest text waiting to be written
+        self._pending_edits = {}
+        # (chat_id, message_id) -> task writing it
+        self._edit_tasks = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def queue_length(self) -> int:
+        """Number of calls waiting for a send slot."""
+        return len(self._waiters)
+
+    def pause(self, seconds: float) -> None:
+        """Stop granting send slots for `seconds`."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int, priority: int = PRIORITY_REPLY) -> None:
+        """Wait until a call to `chat_id` may be sent."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._waiters.append([priority, self._seq, chat_id, future])
+        self._waiters.sort(key=lambda w: (w[0], w[1]))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._waiters = [w for w in self._waiters if w[3] is not future]
+            raise
+
+    def _grant_next(self):
+        """Hand a slot to the best-priority waiter whose chat has a token.
+
+        Returns None when a slot was granted, otherwise how long to wait.
+        """
+        delay = max(self._paused_until - time.monotonic(), self.global_bucket.wait_time())
+        if delay > 0:
+            return delay
+
+        for waiter in self._waiters:
+            chat_bucket = self._chat_bucket(waiter[2])
+            chat_wait = chat_bucket.wait_time()
+            if chat_wait == 0:
+                self._waiters.remove(waiter)
+                self.global_bucket.take()
+                chat_bucket.take()
+                if not waiter[3].done():
+                    waiter[3].set_result(None)
+                return None
+            delay = chat_wait if delay <= 0 else min(delay, chat_wait)
+        return delay
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._grant_next()
+            if delay is None:
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _flood_pause(self, error: RetryAfter, attempt: int) -> None:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            retry_after = retry_after.total_seconds()
+        logger.warning(f"Flood limit hit, pausing sends for {retry_after}s "
+                       f"(attempt {attempt + 1}/{self.max_flood_retries})")
+        self.pause(retry_after)
+
+    async def call(self, chat_id: int, func, *args, priority: int = PRIORITY_REPLY, **kwargs):
+        """Run a Telegram API call once a slot is free, honoring RetryAfter."""
+        for attempt in range(self.max_flood_retries):
+            await self.acquire(chat_id, priority)
+            try:
+                return await func(*args, **kwargs)
+            except RetryAfter as e:
+                self._flood_pause(e, attempt)
+        raise RuntimeError('Telegram kept rejecting the request with RetryAfter')
+
+    def edit_status(self, message, text: str) -> None:
+        """Update a progress message in the background.
+
+        Returns at once, so progress updates never slow down the job posting
+        them. Only the latest text per message is kept and written as soon
+        as a progress slot is free.
+        """
+        if message is None:
+            return
+        key = (message.chat_id, message.message_id)
+        self._pending_edits[key] = text
+        task = self._edit_tasks.get(key)
+        if task is None or task.done():
+            self._edit_tasks[key] = asyncio.create_task(self._write_status(message, key))
+
+    def drop_status(self, message) -> None:
+        """Forget pending updates of a progress message, e.g. before deleting it."""
+        if message is None:
+            return
+        key = (message.chat_id, message.message_id)
+        self._pending_edits.pop(key, None)
+        task = self._edit_tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _write_status(self, message, key) -> None:
+        attempt = 0
+        try:
+            while key in self._pending_edits and attempt < self.max_flood_retries:
+                await self.acquire(message.chat_id, PRIORITY_PROGRESS)
+                sent_text = self._pending_edits.get(key)
+                if sent_text is None:
+                    return
+                try:
+                    await message.edit_text(sent_text)
+                except RetryAfter as e:
+                    self._flood_pause(e, attempt)
+                    attempt += 1
+                    continue
+                except BadRequest as e:
+                    # Unchanged text or an already deleted status message
+                    logger.debug(f"Skipped status edit: {str(e)}")
+                except Exception as e:
+                    # Nobody awaits this task, so failures end here
+                    logger.warning(f"Status edit failed: {str(e)}")
+                    return
+                # A newer text may have arrived while this edit was in flight
+                if self._pending_edits.get(key) == sent_text:
+                    return
+        finally:
+            if self._edit_tasks.get(key) is asyncio.current_task():
+                del self._edit_tasks[key]
+                self._pending_edits.pop(key, None)
+
+# Shared by every handler in the bot
+scheduler = SendScheduler()
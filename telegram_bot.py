@@ -1,15 +1,27 @@
 import os
+import re
+import json
+import shutil
 import logging
 import asyncio
+import threading
+import subprocess
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
-from video_downloader import download_video, get_video_info
+from video_downloader import download_video, resolve_video
+from format_index import get_format_index, find_format, format_size
+from disk_budget import DiskBudget, estimate_footprint
+from clipper import parse_time, plan_split
+from media_probe import probe_media_async, make_thumbnail, thumbnail_time, video_attributes
+from send_scheduler import scheduler
+from uploader import upload_video
+from ffmpeg_pool import ffmpeg_pool
+from log_setup import setup_logging, log_context
+from profiler import span, profile_job, should_profile, set_profiling, profile_next_jobs, profiling_status, PROFILE_DIR
+from job_store import create_job, save_job, update_job, mark_part_delivered, finish_job, load_pending_jobs, job_dir, DOWNLOADS_ROOT
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Enable logging (LOG_LEVEL / YTDLP_LOG_LEVEL tune verbosity)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # States for conversation handler
@@ -18,14 +30,44 @@ SELECTING_QUALITY, SELECTING_FORMAT, SELECTING_CLIP = range(3)
 # Store active downloads
 active_downloads = {}
 
+# Telegram user IDs allowed to use admin commands such as /profile
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# Telegram upload limit we stay under; bigger files get split
+MAX_UPLOAD_SIZE = 40 * 1024 * 1024  # 40MB
+
+# Disk space accounting for downloads/ and optional RAM scratch for small jobs
+disk_budget = DiskBudget(DOWNLOADS_ROOT, headroom=int(os.environ.get('DISK_HEADROOM_MB', 512)) * 1024 * 1024)
+DISK_WAIT_TIMEOUT = 10 * 60
+RAM_SCRATCH_DIR = os.environ.get('RAM_SCRATCH_DIR')  # e.g. /dev/shm, unset disables it
+RAM_SCRATCH_MAX = int(os.environ.get('RAM_SCRATCH_MAX_MB', 64)) * 1024 * 1024
+ram_budget = DiskBudget(RAM_SCRATCH_DIR, headroom=64 * 1024 * 1024) if RAM_SCRATCH_DIR else None
+
+# Speculative prefetch of the likely choice while a /quality or /format menu is open
+SPECULATIVE_PREFETCH = os.environ.get('SPECULATIVE_PREFETCH', '').lower() in ('1', 'true', 'yes')
+SPECULATIVE_BUDGET = int(os.environ.get('SPECULATIVE_BUDGET_MB', 512)) * 1024 * 1024
+SPECULATIVE_TIMEOUT = int(os.environ.get('SPECULATIVE_TIMEOUT', 180))
+speculative_bytes = 0  # estimated size of speculative downloads in flight
+# Resolved stream URLs of a speculative job, kept in its folder
+INFO_FILE = '.info.json'
+
 # Get token from environment variable
 TELEGRAM_TOKEN = "TELEGRAM_BOT_TOKEN"
 if not TELEGRAM_TOKEN:
     raise ValueError("Please set the TELEGRAM_TOKEN environment variable")
 
+async def reply(update: Update, text: str, **kwargs):
+    """Reply to the message or button press behind an update, through the send scheduler."""
+    message = update.callback_query.message if update.callback_query else update.message
+    return await scheduler.call(message.chat_id, message.reply_text, text, **kwargs)
+
+async def send_text(bot, chat_id: int, text: str, **kwargs):
+    """Send a text message to a chat through the send scheduler."""
+    return await scheduler.call(chat_id, bot.send_message, chat_id, text, **kwargs)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
-    await update.message.reply_text(
+    await reply(update,
         '👋 Welcome to the Video Downloader Bot!\n\n'
         'I can help you download videos from YouTube.\n\n'
         'Available commands:\n'
@@ -35,13 +77,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         '/format <url> - Choose specific format\n'
         '/clip <url> - Download a portion\n'
         '/cancel - Cancel current download\n'
+        '/status - Show download and processing queues\n'
         '/help - Show this help message\n\n'
         'Just send a YouTube URL to download it directly!'
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
-    await update.message.reply_text(
+    await reply(update,
         '📝 Available commands:\n\n'
         '/info <url> - Get video information and available formats\n'
         '/download <url> - Download video in best quality\n'
@@ -49,6 +92,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         '/format <url> - Download in specific format\n'
         '/clip <url> - Download a specific portion of the video\n'
         '/cancel - Cancel current download\n'
+        '/status - Show download and processing queues\n'
         '/help - Show this help message\n\n'
         'Just send a YouTube URL to download it directly!'
     )
@@ -56,190 +100,169 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def get_video_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Get video information when /info command is issued."""
     if not context.args:
-        await update.message.reply_text('Please provide a YouTube URL after /info')
+        await reply(update, 'Please provide a YouTube URL after /info')
         return
 
     url = context.args[0]
     try:
-        processing_msg = await update.message.reply_text('🔍 Getting video information...')
-        info = get_video_info(url)
-        
+        processing_msg = await reply(update, '🔍 Getting video information...')
+        index = await asyncio.to_thread(get_format_index, url)
+
         response = (
             f"📹 *Video Information*\n\n"
-            f"*Title:* {info.get('title', 'Unknown')}\n"
-            f"*Length:* {info.get('duration', 'Unknown')} seconds\n"
-            f"*Views:* {info.get('view_count', 'Unknown')}\n\n"
+            f"*Title:* {index['title']}\n"
+            f"*Length:* {index['duration'] or 'Unknown'} seconds\n"
+            f"*Views:* {index['view_count'] or 'Unknown'}\n\n"
             f"*Available Formats:*\n"
         )
-        
-        for f in info.get('formats', [])[:5]:
-            tag = f.get('format_id')
-            ext = f.get('ext')
-            res = f.get('height') or f.get('abr') or ''
-            note = f.get('format_note', '')
-            response += f"• {ext} @ {res} {note}\n"
-        
-        await processing_msg.edit_text(response, parse_mode='Markdown')
-        
+
+        for f in index['summary']:
+            response += f"• {f['ext']} @ {f['res']} {f['note']}\n"
+
+        await scheduler.call(processing_msg.chat_id, processing_msg.edit_text, response, parse_mode='Markdown')
+
     except Exception as e:
-        await update.message.reply_text(f'❌ Error: {str(e)}')
+        await reply(update, f'❌ Error: {str(e)}')
 
-async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show quality options when /quality command is issued."""
-    if not context.args:
-        await update.message.reply_text('Please provide a YouTube URL after /quality')
-        return
+def build_quality_keyboard(index: dict) -> InlineKeyboardMarkup:
+    """Build the /quality keyboard, cached on the format index."""
+    keyboards = index.setdefault('keyboards', {})
+    if 'quality' in keyboards:
+        return keyboards['quality']
 
-    url = context.args[0]
-    try:
-        processing_msg = await update.message.reply_text('🔍 Getting quality options...')
-        info = get_video_info(url)
-        
-        # Create quality selection keyboard with better organization
-        keyboard = []
-        current_row = []
-        
-        # Sort formats by resolution (height)
-        formats = sorted(
-            [f for f in info.get('formats', []) if f.get('height')],
-            key=lambda x: x.get('height', 0),
-            reverse=True
-        )
-        
-        for f in formats:
-            quality = f"{f.get('height')}p"
-            format_id = f.get('format_id')
-            # Add FPS if available
-            fps = f.get('fps')
-            if fps:
-                quality += f" {fps}fps"
-            
-            # Calculate file size
-            filesize = f.get('filesize')
-            if not filesize:
-                # Try to get filesize from format_id
-                format_info = next((fmt for fmt in info.get('formats', []) if fmt.get('format_id') == format_id), None)
-                if format_info:
-                    filesize = format_info.get('filesize')
-            
-            # Format file size
-            if filesize:
-                if filesize < 1024 * 1024:  # Less than 1MB
-                    size_str = f"{filesize/1024:.1f}KB"
-                else:
-                    size_str = f"{filesize/(1024*1024):.1f}MB"
-                quality += f" ({size_str})"
-            
-            button = InlineKeyboardButton(quality, callback_data=f"quality_{format_id}")
+    # Create quality selection keyboard with better organization
+    keyboard = []
+    current_row = []
+
+    # Formats are already sorted by resolution (height)
+    for f in index['video']:
+        quality = f"{f['height']}p"
+        # Add FPS if available
+        if f['fps']:
+            quality += f" {f['fps']}fps"
+
+        # Add file size, marking estimates
+        if f['size']:
+            prefix = '~' if f['size_estimated'] else ''
+            quality += f" ({prefix}{format_size(f['size'])})"
+
+        button = InlineKeyboardButton(quality, callback_data=f"quality_{f['format_id']}")
+        current_row.append(button)
+
+        # Create new row after every 2 buttons
+        if len(current_row) == 2:
+            keyboard.append(current_row)
+            current_row = []
+
+    # Add any remaining buttons
+    if current_row:
+        keyboard.append(current_row)
+
+    # Add a "Best Quality" button at the top
+    keyboard.insert(0, [InlineKeyboardButton("🎯 Best Quality", callback_data="quality_best")])
+
+    keyboards['quality'] = InlineKeyboardMarkup(keyboard)
+    return keyboards['quality']
+
+def build_format_keyboard(index: dict) -> InlineKeyboardMarkup:
+    """Build the /format keyboard, cached on the format index."""
+    keyboards = index.setdefault('keyboards', {})
+    if 'format' in keyboards:
+        return keyboards['format']
+
+    # Create format selection keyboard with better organization
+    keyboard = []
+    current_row = []
+
+    # Add video formats
+    if index['video']:
+        keyboard.append([InlineKeyboardButton("📹 Video Formats", callback_data="format_header")])
+        for f in index['video']:
+            fps_text = f" {f['fps']}fps" if f['fps'] else ""
+            text = f"🎥 {f['ext']} {f['height']}p{fps_text}"
+            button = InlineKeyboardButton(text, callback_data=f"format_{f['format_id']}")
             current_row.append(button)
-            
-            # Create new row after every 2 buttons
             if len(current_row) == 2:
                 keyboard.append(current_row)
                 current_row = []
-        
-        # Add any remaining buttons
         if current_row:
             keyboard.append(current_row)
-        
-        # Add a "Best Quality" button at the top
-        keyboard.insert(0, [InlineKeyboardButton("🎯 Best Quality", callback_data="quality_best")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await processing_msg.edit_text(
-            f"📹 *{info.get('title', 'Video')}*\n\n"
+            current_row = []
+
+    # Add audio formats
+    if index['audio']:
+        keyboard.append([InlineKeyboardButton("🎵 Audio Formats", callback_data="format_header")])
+        for f in index['audio']:
+            text = f"🎵 {f['ext']} {f['abr']:g}kbps"
+            button = InlineKeyboardButton(text, callback_data=f"format_{f['format_id']}")
+            current_row.append(button)
+            if len(current_row) == 2:
+                keyboard.append(current_row)
+                current_row = []
+        if current_row:
+            keyboard.append(current_row)
+
+    keyboards['format'] = InlineKeyboardMarkup(keyboard)
+    return keyboards['format']
+
+async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show quality options when /quality command is issued."""
+    if not context.args:
+        await reply(update, 'Please provide a YouTube URL after /quality')
+        return
+
+    url = context.args[0]
+    try:
+        processing_msg = await reply(update, '🔍 Getting quality options...')
+        index = await asyncio.to_thread(get_format_index, url)
+
+        await scheduler.call(
+            processing_msg.chat_id, processing_msg.edit_text,
+            f"📹 *{index['title']}*\n\n"
             "Select video quality:\n"
             "Note: Files larger than 50MB will be compressed or split",
-            reply_markup=reply_markup,
+            reply_markup=build_quality_keyboard(index),
             parse_mode='Markdown'
         )
         context.user_data['url'] = url
-        
+        await start_speculation(update, context, url, index)
+
     except Exception as e:
-        await update.message.reply_text(f'❌ Error: {str(e)}')
+        await reply(update, f'❌ Error: {str(e)}')
 
 async def format_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show format options when /format command is issued."""
     if not context.args:
-        await update.message.reply_text('Please provide a YouTube URL after /format')
+        await reply(update, 'Please provide a YouTube URL after /format')
         return
 
     url = context.args[0]
     try:
-        processing_msg = await update.message.reply_text('🔍 Getting format options...')
-        info = get_video_info(url)
-        
-        # Create format selection keyboard with better organization
-        keyboard = []
-        current_row = []
-        
-        # Group formats by type (video, audio, etc.)
-        video_formats = []
-        audio_formats = []
-        
-        for f in info.get('formats', []):
-            format_id = f.get('format_id')
-            ext = f.get('ext')
-            res = f.get('height') or f.get('abr') or ''
-            note = f.get('format_note', '')
-            
-            # Add FPS if available
-            fps = f.get('fps')
-            fps_text = f" {fps}fps" if fps else ""
-            
-            if f.get('height'):  # Video format
-                text = f"🎥 {ext} {res}p{fps_text}"
-                video_formats.append((text, format_id, f.get('height', 0)))
-            elif f.get('abr'):  # Audio format
-                text = f"🎵 {ext} {res}kbps"
-                audio_formats.append((text, format_id, float(f.get('abr', 0))))
-        
-        # Add video formats
-        if video_formats:
-            keyboard.append([InlineKeyboardButton("📹 Video Formats", callback_data="format_header")])
-            for text, format_id, _ in sorted(video_formats, key=lambda x: x[2], reverse=True):
-                button = InlineKeyboardButton(text, callback_data=f"format_{format_id}")
-                current_row.append(button)
-                if len(current_row) == 2:
-                    keyboard.append(current_row)
-                    current_row = []
-            if current_row:
-                keyboard.append(current_row)
-                current_row = []
-        
-        # Add audio formats
-        if audio_formats:
-            keyboard.append([InlineKeyboardButton("🎵 Audio Formats", callback_data="format_header")])
-            for text, format_id, _ in sorted(audio_formats, key=lambda x: x[2], reverse=True):
-                button = InlineKeyboardButton(text, callback_data=f"format_{format_id}")
-                current_row.append(button)
-                if len(current_row) == 2:
-                    keyboard.append(current_row)
-                    current_row = []
-            if current_row:
-                keyboard.append(current_row)
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await processing_msg.edit_text(
-            f"📹 *{info.get('title', 'Video')}*\n\n"
+        processing_msg = await reply(update, '🔍 Getting format options...')
+        index = await asyncio.to_thread(get_format_index, url)
+
+        await scheduler.call(
+            processing_msg.chat_id, processing_msg.edit_text,
+            f"📹 *{index['title']}*\n\n"
             "Select format:",
-            reply_markup=reply_markup,
+            reply_markup=build_format_keyboard(index),
             parse_mode='Markdown'
         )
         context.user_data['url'] = url
-        
+        await start_speculation(update, context, url, index)
+
     except Exception as e:
-        await update.message.reply_text(f'❌ Error: {str(e)}')
+        await reply(update, f'❌ Error: {str(e)}')
 
 async def clip_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start clip selection process."""
     if not context.args:
-        await update.message.reply_text('Please provide a YouTube URL after /clip')
+        await reply(update, 'Please provide a YouTube URL after /clip')
         return
 
     url = context.args[0]
     context.user_data['url'] = url
-    await update.message.reply_text(
+    await reply(update,
         'Please enter the clip duration in this format:\n'
         'start_time-end_time\n\n'
         'Example: 1:30-2:45\n'
@@ -253,25 +276,53 @@ async def handle_clip_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         start_time, end_time = update.message.text.split('-')
         url = context.user_data.get('url')
         if not url:
-            await update.message.reply_text('❌ No URL found. Please use /clip <url> again.')
+            await reply(update, '❌ No URL found. Please use /clip <url> again.')
             return ConversationHandler.END
 
         await download_video_command(update, context, start_time=start_time.strip(), end_time=end_time.strip())
         return ConversationHandler.END
         
     except ValueError:
-        await update.message.reply_text('❌ Invalid format. Please use start-end format (e.g., 1:30-2:45)')
+        await reply(update, '❌ Invalid format. Please use start-end format (e.g., 1:30-2:45)')
         return SELECTING_CLIP
 
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show load of the download, ffmpeg and send queues."""
+    running = ffmpeg_pool.running()
+    await reply(update,
+        '📊 Bot status\n\n'
+        f'Active downloads: {len(active_downloads)}\n'
+        f'ffmpeg encodes: {running["encodes"]}/{ffmpeg_pool.max_encodes} running, '
+        f'{ffmpeg_pool.queue_length(encode=True)} queued\n'
+        f'ffmpeg copies: {running["copies"]} running, {ffmpeg_pool.queue_length(encode=False)} queued\n'
+        f'Telegram sends queued: {scheduler.queue_length()}'
+    )
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Turn per-job profiling on or off (admins only)."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await reply(update, '❌ This command is only available to admins')
+        return
+
+    arg = context.args[0].lower() if context.args else ''
+    if arg in ('on', 'off'):
+        set_profiling(arg == 'on')
+    elif arg == 'next':
+        profile_next_jobs()
+    elif arg:
+        await reply(update, 'Usage: /profile [on|off|next]')
+        return
+    await reply(update, f'🔬 Profiling is {profiling_status()}\nTraces are written to {PROFILE_DIR}')
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Cancel current download."""
     user_id = update.effective_user.id
     if user_id in active_downloads:
         # Implement download cancellation logic here
         del active_downloads[user_id]
-        await update.message.reply_text('✅ Download cancelled')
+        await reply(update, '✅ Download cancelled')
     else:
-        await update.message.reply_text('No active download to cancel')
+        await reply(update, 'No active download to cancel')
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button callbacks."""
@@ -288,7 +339,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             url = context.user_data.get('url')
             if url:
                 # Send new message for download status
-                status_msg = await query.message.reply_text('⏳ Starting download...')
+                status_msg = await reply(update, '⏳ Starting download...')
                 context.user_data['status_msg'] = status_msg
                 await download_video_command(update, context, format_id=format_id)
         
@@ -297,36 +348,27 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             url = context.user_data.get('url')
             if url:
                 # Send new message for download status
-                status_msg = await query.message.reply_text('⏳ Starting download...')
+                status_msg = await reply(update, '⏳ Starting download...')
                 context.user_data['status_msg'] = status_msg
                 await download_video_command(update, context, format_id=format_id)
     
     except Exception as e:
-        await query.message.reply_text(f'❌ Error: {str(e)}')
+        await reply(update, f'❌ Error: {str(e)}')
 
-async def send_video_part(update: Update, part_file: str, part_num: int, total_parts: int, max_retries: int = 3) -> bool:
-    """Send a video part with retries."""
-    for attempt in range(max_retries):
-        try:
-            if update.callback_query:
-                await update.callback_query.message.reply_video(
-                    video=open(part_file, 'rb'),
-                    supports_streaming=True,
-                    caption=f'Part {part_num}/{total_parts}'
-                )
-            else:
-                await update.message.reply_video(
-                    video=open(part_file, 'rb'),
-                    supports_streaming=True,
-                    caption=f'Part {part_num}/{total_parts}'
-                )
-            return True
-        except Exception as e:
-            print(f"Error sending part {part_num} (attempt {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(2)  # Wait before retry
-            continue
-    return False
+async def send_video_part(bot, chat_id: int, part_file: str, part_num: int, total_parts: int,
+                          max_retries: int = 3, **kwargs) -> bool:
+    """Send a video part with retries (kwargs: thumbnail and send attributes)."""
+    return await upload_video(bot, chat_id, part_file, caption=f'Part {part_num}/{total_parts}',
+                              max_retries=max_retries, **kwargs)
+
+async def probe_job_media(job: dict, video_file: str) -> dict:
+    """Probe the job's video once and keep the result in its checkpoint."""
+    media = job.get('media')
+    if not media or media.get('path') != video_file:
+        with span('probe', file=os.path.basename(video_file)):
+            media = await probe_media_async(video_file)
+        update_job(job, media=media)
+    return media
 
 async def cleanup_file(file_path: str, max_retries: int = 5) -> bool:
     """Clean up a file with retries."""
@@ -336,338 +378,554 @@ async def cleanup_file(file_path: str, max_retries: int = 5) -> bool:
                 os.remove(file_path)
             return True
         except Exception as e:
-            print(f"Error cleaning up {file_path} (attempt {attempt + 1}/{max_retries}): {str(e)}")
+            logger.warning(f"Error cleaning up {file_path} (attempt {attempt + 1}/{max_retries}): {str(e)}")
             if attempt < max_retries - 1:
                 await asyncio.sleep(1)  # Wait before retry
             continue
     return False
 
-async def split_and_send_video(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                             video_file: str, max_size: int, processing_msg) -> bool:
+def cleanup_job_dir(job: dict) -> None:
+    """Remove the working directory of a job."""
+    download_dir = job_dir(job)
+    try:
+        if os.path.exists(download_dir):
+            shutil.rmtree(download_dir)
+            logger.info(f"Cleaned up download folder: {download_dir}")
+    except Exception as e:
+        logger.warning(f"Error cleaning up download folder {download_dir}: {str(e)}")
+
+async def split_and_send_video(bot, job: dict, video_file: str, max_size: int, processing_msg) -> bool:
     """Split large video into parts and send them."""
+    chat_id = job['chat_id']
     try:
-        import subprocess
-        # Get video duration
-        duration = float(subprocess.check_output([
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1', video_file
-        ]).decode().strip())
-        
-        # Calculate number of parts needed
-        file_size = os.path.getsize(video_file)
-        num_parts = (file_size // max_size) + 1
-        part_duration = duration / num_parts
-        
+        media = await probe_job_media(job, video_file)
+
+        # Parts end on keyframes; the plan is kept stable across restarts
+        plan = job.get('split_plan')
+        if not plan:
+            plan = plan_split(media, os.path.getsize(video_file), max_size)
+            update_job(job, stage='sending', split_plan=plan, num_parts=len(plan))
+        num_parts = len(plan)
+
         # Create a list to track successful parts
         successful_parts = []
         failed_parts = []
-        
-        # Split video into parts
+
+        # Split video into parts, skipping parts delivered before a restart
         for i in range(num_parts):
+            if i + 1 in job['delivered_parts']:
+                continue
             part_file = os.path.join(os.path.dirname(video_file), f'part{i+1}_{os.path.basename(video_file)}')
-            start_time = i * part_duration
-            
+            start_time, end_time = plan[i]
+
             # Try to split the part
             try:
                 # Update progress message
-                await processing_msg.edit_text(f'📦 Splitting video... Part {i+1}/{num_parts}')
-                
-                # Split with error checking
-                result = subprocess.run([
-                    'ffmpeg', '-i', video_file,
-                    '-ss', str(start_time),
-                    '-t', str(part_duration),
-                    '-c', 'copy',  # Use copy to avoid re-encoding
+                scheduler.edit_status(processing_msg, f'📦 Splitting video... Part {i+1}/{num_parts}')
+
+                # Split with error checking; input seeking lands on the keyframe
+                await ffmpeg_pool.run([
+                    'ffmpeg', '-ss', f'{start_time:.6f}', '-i', video_file,
+                    '-t', f'{end_time - start_time:.6f}',
+                    '-map', '0', '-c', 'copy',  # Use copy to avoid re-encoding
+                    '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
                     '-y',  # Overwrite output file if it exists
                     part_file
-                ], capture_output=True, text=True, check=True)
-                
+                ], encode=False)
+
                 # Check if part file exists and has content
                 if os.path.exists(part_file) and os.path.getsize(part_file) > 0:
                     successful_parts.append((i+1, part_file))
                 else:
                     failed_parts.append(i+1)
-                    print(f"Part {i+1} was created but is empty")
-                    
+                    logger.warning(f"Part {i+1} was created but is empty")
+
             except subprocess.CalledProcessError as e:
-                print(f"Error splitting part {i+1}: {e.stderr}")
+                logger.warning(f"Error splitting part {i+1}: {e.stderr}")
                 failed_parts.append(i+1)
                 continue
-        
+
         # If we have failed parts, try to recover them
         if failed_parts:
-            await processing_msg.edit_text('⚠️ Some parts failed, attempting to recover...')
-            
+            scheduler.edit_status(processing_msg, '⚠️ Some parts failed, attempting to recover...')
+
             for part_num in failed_parts[:]:  # Create a copy of the list to modify during iteration
                 part_file = os.path.join(os.path.dirname(video_file), f'part{part_num}_{os.path.basename(video_file)}')
-                start_time = (part_num - 1) * part_duration
-                
+                start_time, end_time = plan[part_num - 1]
+
                 # Try alternative splitting method
                 try:
-                    await processing_msg.edit_text(f'🔄 Retrying part {part_num}/{num_parts}...')
-                    
+                    scheduler.edit_status(processing_msg, f'🔄 Retrying part {part_num}/{num_parts}...')
+
                     # Try with different parameters
-                    result = subprocess.run([
-                        'ffmpeg', '-i', video_file,
-                        '-ss', str(start_time),
-                        '-t', str(part_duration),
+                    await ffmpeg_pool.run([
+                        'ffmpeg', '-ss', f'{start_time:.6f}', '-i', video_file,
+                        '-t', f'{end_time - start_time:.6f}',
                         '-c:v', 'libx264',  # Use h264 codec
                         '-preset', 'ultrafast',  # Fastest encoding
                         '-c:a', 'aac',  # Use AAC audio
+                        '-movflags', '+faststart',
                         '-y',  # Overwrite output file
                         part_file
-                    ], capture_output=True, text=True, check=True)
-                    
+                    ], encode=True)
+
                     if os.path.exists(part_file) and os.path.getsize(part_file) > 0:
                         successful_parts.append((part_num, part_file))
                         failed_parts.remove(part_num)
-                        
+
                 except Exception as e:
-                    print(f"Failed to recover part {part_num}: {str(e)}")
+                    logger.error(f"Failed to recover part {part_num}: {str(e)}")
                     continue
-        
+
         # Send successful parts
         for part_num, part_file in sorted(successful_parts):
+            start_time, end_time = plan[part_num - 1]
+            # Thumbnail comes from the source, which already has the keyframes probed
+            thumbnail = await make_thumbnail(
+                video_file, thumbnail_time(media, start_time, end_time),
+                os.path.splitext(part_file)[0] + '.jpg'
+            )
             try:
                 # Try to send the part with retries
-                if await send_video_part(update, part_file, part_num, num_parts):
-                    print(f"Successfully sent part {part_num}")
+                if await send_video_part(bot, chat_id, part_file, part_num, num_parts, thumbnail=thumbnail,
+                                         **video_attributes(media, end_time - start_time)):
+                    logger.info(f"Successfully sent part {part_num}")
+                    mark_part_delivered(job, part_num)
                 else:
-                    print(f"Failed to send part {part_num} after all retries")
+                    logger.error(f"Failed to send part {part_num} after all retries")
                     failed_parts.append(part_num)
             finally:
                 # Clean up part file with retries
                 await cleanup_file(part_file)
-        
+                if thumbnail:
+                    await cleanup_file(thumbnail)
+
         # Report any remaining failed parts
         if failed_parts:
             failed_parts_str = ', '.join(map(str, sorted(failed_parts)))
-            if update.callback_query:
-                await update.callback_query.message.reply_text(
-                    f'⚠️ Some parts failed to process: {failed_parts_str}\n'
-                    'Please try downloading in a lower quality.'
-                )
-            else:
-                await update.message.reply_text(
-                    f'⚠️ Some parts failed to process: {failed_parts_str}\n'
-                    'Please try downloading in a lower quality.'
-                )
+            await send_text(
+                bot, chat_id,
+                f'⚠️ Some parts failed to process: {failed_parts_str}\n'
+                'Please try downloading in a lower quality.'
+            )
             # Clean up download folder after sending all parts (even if some failed)
-            try:
-                download_dir = os.path.dirname(video_file)
-                if os.path.exists(download_dir):
-                    shutil.rmtree(download_dir)
-                    print(f"Cleaned up download folder: {download_dir}")
-            except Exception as e:
-                print(f"Error cleaning up download folder {download_dir}: {str(e)}")
+            cleanup_job_dir(job)
             return False
-        
+
         # Clean up download folder after sending all parts
-        try:
-            download_dir = os.path.dirname(video_file)
-            if os.path.exists(download_dir):
-                shutil.rmtree(download_dir)
-                print(f"Cleaned up download folder: {download_dir}")
-        except Exception as e:
-            print(f"Error cleaning up download folder {download_dir}: {str(e)}")
-        
+        cleanup_job_dir(job)
         return True
-        
+
     except Exception as e:
-        print(f"Error in split_and_send_video: {str(e)}")
-        if update.callback_query:
-            await update.callback_query.message.reply_text('❌ Error processing video. Please try a lower quality.')
-        else:
-            await update.message.reply_text('❌ Error processing video. Please try a lower quality.')
+        logger.exception(f"Error in split_and_send_video: {str(e)}")
+        await send_text(bot, chat_id, '❌ Error processing video. Please try a lower quality.')
         # Clean up download folder on error
-        try:
-            download_dir = os.path.dirname(video_file)
-            if os.path.exists(download_dir):
-                shutil.rmtree(download_dir)
-                print(f"Cleaned up download folder: {download_dir}")
-        except Exception as e:
-            print(f"Error cleaning up download folder {download_dir}: {str(e)}")
+        cleanup_job_dir(job)
         return False
 
-async def download_video_command(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                               format_id: str = None, start_time: str = None, end_time: str = None) -> None:
-    """Download video with specified options."""
-    url = context.args[0] if context.args else context.user_data.get('url')
-    if not url:
-        if update.callback_query:
-            await update.callback_query.message.reply_text('Please provide a YouTube URL')
-        else:
-            await update.message.reply_text('Please provide a YouTube URL')
+def find_downloaded_file(download_dir: str):
+    """Return the newest finished file in a job folder, ignoring partial downloads."""
+    files = [
+        os.path.join(download_dir, f) for f in os.listdir(download_dir)
+        if not f.endswith(('.part', '.ytdl')) and not re.match(r'part\d+_', f) and f != INFO_FILE
+    ]
+    if not files:
+        return None
+    return max(files, key=os.path.getctime)
+
+async def reserve_disk_space(job: dict, processing_msg) -> bool:
+    """Reserve the estimated peak disk usage of a job, downgrading or queueing it if needed."""
+    try:
+        index = await asyncio.to_thread(get_format_index, job['url'])
+    except Exception as e:
+        logger.warning(f"No format metadata for the disk estimate: {str(e)}")
+        index = None
+    entry = find_format(index, job['format_id']) if index else None
+
+    clip_fraction = None
+    if index and index['duration'] and (job['start_time'] or job['end_time']):
+        start = parse_time(job['start_time']) if job['start_time'] else 0
+        end = parse_time(job['end_time']) if job['end_time'] else index['duration']
+        clip_fraction = min(1, max(0, end - start) / index['duration'])
+
+    def estimate(f):
+        return estimate_footprint(f and f['size'], f['needs_transcode'] if f else True,
+                                  MAX_UPLOAD_SIZE, clip_fraction)
+
+    needed = estimate(entry)
+    job_id = job['job_id']
+
+    # Small jobs can run from RAM backed scratch space
+    if ram_budget and needed <= RAM_SCRATCH_MAX:
+        ram_dir = os.path.join(RAM_SCRATCH_DIR, 'video-bot', job_id)
+        if ram_budget.try_reserve(job_id, needed, ram_dir, await ram_budget.measure()):
+            update_job(job, work_dir=ram_dir)
+            return True
+
+    # One scan of the reserved folders serves the direct try and the downgrades
+    usage = await disk_budget.measure()
+    if disk_budget.try_reserve(job_id, needed, job_dir(job), usage):
+        return True
+
+    # Downgrade to the best lower quality that fits right now
+    if entry and 'height' in entry:
+        for lower in index['video']:
+            if lower['height'] >= entry['height'] or lower['has_audio'] != entry['has_audio']:
+                continue
+            if disk_budget.try_reserve(job_id, estimate(lower), job_dir(job), usage):
+                update_job(job, format_id=lower['format_id'])
+                scheduler.edit_status(
+                    processing_msg, f"💾 Low on disk space, downloading {lower['height']}p instead..."
+                )
+                return True
+
+    # Nothing fits: queue until running jobs free their space
+    scheduler.edit_status(processing_msg, '⏳ Waiting for free disk space...')
+    return await disk_budget.reserve(job_id, needed, job_dir(job), timeout=DISK_WAIT_TIMEOUT)
+
+def has_disk_reservation(job: dict) -> bool:
+    return (job['job_id'] in disk_budget.reservations
+            or bool(ram_budget and job['job_id'] in ram_budget.reservations))
+
+async def reserve_known_size(job: dict, nbytes: int) -> bool:
+    """Reserve space for a job whose download is already on disk, in the budget it lives in."""
+    in_ram = ram_budget and job.get('work_dir') and job['work_dir'].startswith(RAM_SCRATCH_DIR)
+    budget = ram_budget if in_ram else disk_budget
+    return await budget.reserve(job['job_id'], nbytes, job_dir(job), timeout=DISK_WAIT_TIMEOUT)
+
+async def resize_disk_reservation(job: dict, nbytes: int) -> None:
+    """Adjust the reservation of a job, wherever it was made."""
+    await disk_budget.resize(job['job_id'], nbytes)
+    if ram_budget:
+        await ram_budget.resize(job['job_id'], nbytes)
+
+async def release_disk_space(job: dict) -> None:
+    await disk_budget.release(job['job_id'])
+    if ram_budget:
+        await ram_budget.release(job['job_id'])
+
+def pick_speculative_format(index: dict):
+    """Most likely menu choice: the best format with audio that can be sent without splitting."""
+    for f in index['video']:
+        if f['has_audio'] and f['size'] and f['size'] <= MAX_UPLOAD_SIZE:
+            return f
+    return None
+
+async def start_speculation(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, index: dict) -> None:
+    """Start downloading the likely choice while the user is still looking at the menu."""
+    global speculative_bytes
+    previous = context.user_data.pop('speculation', None)
+    if previous:
+        context.application.create_task(discard_speculation(previous))
+    if not SPECULATIVE_PREFETCH:
         return
 
-    processing_msg = context.user_data.get('status_msg')
-    downloaded_file = None
-    download_dir = os.path.join(os.getcwd(), 'downloads')
-    
+    entry = pick_speculative_format(index)
+    if not entry:
+        return
+
+    # Not checkpointed: a restart must not turn a guess into a real job
+    job = create_job(update.effective_chat.id, update.effective_user.id, url, entry['format_id'], save=False)
+    spec = {'job': job, 'size': 0, 'cancel_event': threading.Event()}
+    needed = estimate_footprint(entry['size'], entry['needs_transcode'], MAX_UPLOAD_SIZE)
+    if (speculative_bytes + entry['size'] <= SPECULATIVE_BUDGET
+            and disk_budget.try_reserve(job['job_id'], needed, job_dir(job), await disk_budget.measure())):
+        speculative_bytes += entry['size']
+        spec['size'] = entry['size']
+        spec['task'] = asyncio.create_task(run_speculation(spec))
+        logger.info(f"Speculatively downloading format {entry['format_id']} of {url}")
+    else:
+        # No room for the download itself: resolve the stream URLs so it skips extraction
+        spec['task'] = asyncio.create_task(resolve_speculation(spec))
+        logger.info(f"Speculatively resolving format {entry['format_id']} of {url}")
+    spec['timer'] = asyncio.create_task(expire_speculation(context, spec))
+    context.user_data['speculation'] = spec
+
+async def run_speculation(spec: dict) -> None:
+    """Download stage of a speculative job."""
+    global speculative_bytes
+    job = spec['job']
     try:
-        if not processing_msg:
-            if update.callback_query:
-                processing_msg = await update.callback_query.message.reply_text('⏳ Starting download...')
-            else:
-                processing_msg = await update.message.reply_text('⏳ Starting download...')
-        
-        os.makedirs(download_dir, exist_ok=True)
-        
-        success = download_video(url, download_dir, format_id, start_time, end_time)
-        if not success:
-            if update.callback_query:
-                await update.callback_query.message.reply_text('❌ Download failed. Please try again with different options.')
-            else:
-                await update.message.reply_text('❌ Download failed. Please try again with different options.')
-            # Clean up download folder on failure
-            try:
-                if os.path.exists(download_dir):
-                    shutil.rmtree(download_dir)
-                    print(f"Cleaned up download folder: {download_dir}")
-            except Exception as e:
-                print(f"Error cleaning up download folder {download_dir}: {str(e)}")
-            return
-        
-        files = os.listdir(download_dir)
-        if files:
-            latest_file = max([os.path.join(download_dir, f) for f in files], key=os.path.getctime)
-            downloaded_file = latest_file
-            
-            # Check if file exists and has content
-            if not os.path.exists(latest_file) or os.path.getsize(latest_file) == 0:
-                if update.callback_query:
-                    await update.callback_query.message.reply_text('❌ Downloaded file is empty or missing. Please try again.')
-                else:
-                    await update.message.reply_text('❌ Downloaded file is empty or missing. Please try again.')
-                # Clean up download folder
-                try:
-                    if os.path.exists(download_dir):
-                        shutil.rmtree(download_dir)
-                        print(f"Cleaned up download folder: {download_dir}")
-                except Exception as e:
-                    print(f"Error cleaning up download folder {download_dir}: {str(e)}")
+        with log_context(job_id=job['job_id'], user_id=job['user_id']):
+            download_dir = job_dir(job)
+            os.makedirs(download_dir, exist_ok=True)
+            success = await asyncio.to_thread(
+                download_video, job['url'], download_dir, job['format_id'],
+                cancel_event=spec['cancel_event']
+            )
+            latest_file = find_downloaded_file(download_dir) if success else None
+            if latest_file and not spec['cancel_event'].is_set():
+                job.update(stage='downloaded', video_file=latest_file)
+    except Exception as e:
+        logger.warning(f"Speculative download failed: {str(e)}")
+    finally:
+        speculative_bytes -= spec['size']
+
+def save_resolved_info(job: dict) -> str:
+    """Resolve the stream URLs of a job and store them in its folder."""
+    info = resolve_video(job['url'], job['format_id'])
+    download_dir = job_dir(job)
+    os.makedirs(download_dir, exist_ok=True)
+    info_file = os.path.join(download_dir, INFO_FILE)
+    with open(info_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    return info_file
+
+async def resolve_speculation(spec: dict) -> None:
+    """Extraction stage of a speculative job, when there is no budget to download it."""
+    job = spec['job']
+    try:
+        with log_context(job_id=job['job_id'], user_id=job['user_id']):
+            info_file = await asyncio.to_thread(save_resolved_info, job)
+            if not spec['cancel_event'].is_set():
+                job['info_file'] = info_file
+    except Exception as e:
+        logger.warning(f"Speculative resolution failed: {str(e)}")
+
+async def discard_speculation(spec: dict) -> None:
+    """Cancel a speculative download and free its files and disk reservation."""
+    if spec['timer'] is not asyncio.current_task():
+        # When the timer itself expires the speculation, cancelling it would abort this cleanup
+        spec['timer'].cancel()
+    spec['cancel_event'].set()
+    # The download thread stops at its next progress callback
+    await spec['task']
+    cleanup_job_dir(spec['job'])
+    await release_disk_space(spec['job'])
+    logger.info(f"Discarded speculative download {spec['job']['job_id']}")
+
+async def expire_speculation(context: ContextTypes.DEFAULT_TYPE, spec: dict) -> None:
+    """Drop the speculation when the menu was left unanswered."""
+    await asyncio.sleep(SPECULATIVE_TIMEOUT)
+    if context.user_data.get('speculation') is spec:
+        context.user_data.pop('speculation', None)
+        await discard_speculation(spec)
+
+async def take_speculation(context: ContextTypes.DEFAULT_TYPE, url: str, format_id: str,
+                           start_time: str, end_time: str, processing_msg):
+    """Adopt the speculative job if it matches the user's choice, otherwise cancel it."""
+    spec = context.user_data.pop('speculation', None)
+    if not spec:
+        return None
+
+    job = spec['job']
+    if job['url'] != url or job['format_id'] != format_id or start_time or end_time:
+        context.application.create_task(discard_speculation(spec))
+        return None
+
+    spec['timer'].cancel()
+    scheduler.edit_status(processing_msg, '⚡ Already downloading this one...')
+    await spec['task']
+    if job['stage'] != 'downloaded':
+        # Speculation failed: the job downloads normally, resuming any .part file
+        await release_disk_space(job)
+    save_job(job)
+    return job
+
+async def run_job(bot, job: dict, processing_msg) -> None:
+    """Run a download job, tagging everything it logs with the job and user IDs."""
+    with log_context(job_id=job['job_id'], user_id=job['user_id']), \
+            profile_job(job['job_id'], should_profile()):
+        await process_job(bot, job, processing_msg)
+
+async def process_job(bot, job: dict, processing_msg) -> None:
+    """Run a download job from its last checkpoint until the video is delivered."""
+    chat_id = job['chat_id']
+    active_downloads[job['user_id']] = job['job_id']
+    keep_checkpoint = False
+
+    try:
+        latest_file = job.get('video_file')
+        if job['stage'] == 'downloading' or not latest_file or not os.path.exists(latest_file):
+            with span('reserve disk space'):
+                reserved = await reserve_disk_space(job, processing_msg)
+            if not reserved:
+                await send_text(bot, chat_id, '❌ Not enough disk space right now. Please try again later.')
                 return
-            
-            # Check file size
-            file_size = os.path.getsize(latest_file)
-            max_size = 40 * 1024 * 1024  # 40MB
-            
-            if file_size > max_size:
-                # File is too large, split it into parts
-                await processing_msg.edit_text('📦 File is too large, splitting into parts...')
-                success = await split_and_send_video(update, context, latest_file, max_size, processing_msg)
-                if not success:
-                    return
-                # split_and_send_video will clean up the download folder
-                downloaded_file = None  # Prevent double cleanup below
-            else:
-                # Send the video if it's small enough
-                try:
-                    if update.callback_query:
-                        await update.callback_query.message.reply_video(
-                            video=open(latest_file, 'rb'),
-                            supports_streaming=True
-                        )
-                    else:
-                        await update.message.reply_video(
-                            video=open(latest_file, 'rb'),
-                            supports_streaming=True
-                        )
-                except Exception as e:
-                    print(f"Error sending video: {str(e)}")
-                    if update.callback_query:
-                        await update.callback_query.message.reply_text('❌ Error sending video. Please try again.')
-                    else:
-                        await update.message.reply_text('❌ Error sending video. Please try again.')
-                # Clean up download folder after sending the video
-                try:
-                    if os.path.exists(download_dir):
-                        shutil.rmtree(download_dir)
-                        print(f"Cleaned up download folder: {download_dir}")
-                except Exception as e:
-                    print(f"Error cleaning up download folder {download_dir}: {str(e)}")
+
+            download_dir = job_dir(job)
+            os.makedirs(download_dir, exist_ok=True)
+            resolved = job.get('info_file')
+            if resolved and not os.path.exists(resolved):
+                resolved = None
+            # yt-dlp picks up any .part file left in the job folder
+            with span('download', url=job['url'], format=job['format_id']):
+                success = await asyncio.to_thread(
+                    download_video, job['url'], download_dir, job['format_id'],
+                    job['start_time'], job['end_time'], info_file=resolved
+                )
+            if not success:
+                await send_text(bot, chat_id, '❌ Download failed. Please try again with different options.')
+                cleanup_job_dir(job)
+                return
+
+            latest_file = find_downloaded_file(download_dir)
+            if not latest_file:
+                await send_text(bot, chat_id, '❌ No file was downloaded')
+                cleanup_job_dir(job)
+                return
+            update_job(job, stage='downloaded', video_file=latest_file, media=None)
+
+        # Check if file exists and has content
+        if not os.path.exists(latest_file) or os.path.getsize(latest_file) == 0:
+            await send_text(bot, chat_id, '❌ Downloaded file is empty or missing. Please try again.')
+            cleanup_job_dir(job)
+            return
+
+        # Check file size
+        file_size = os.path.getsize(latest_file)
+        max_size = MAX_UPLOAD_SIZE
+
+        # Download stage is over: only the file and its split parts remain
+        needed = 2 * file_size if file_size > max_size else file_size
+        if has_disk_reservation(job):
+            await resize_disk_reservation(job, needed)
+        elif not await reserve_known_size(job, needed):
+            # Resumed after its download: reservations do not survive a restart
+            await send_text(bot, chat_id, '❌ Not enough disk space right now. Please try again later.')
+            cleanup_job_dir(job)
+            return
+
+        if file_size > max_size:
+            # File is too large, split it into parts
+            scheduler.edit_status(processing_msg, '📦 File is too large, splitting into parts...')
+            # split_and_send_video will clean up the download folder
+            with span('split and send', size=file_size):
+                await split_and_send_video(bot, job, latest_file, max_size, processing_msg)
         else:
-            if update.callback_query:
-                await update.callback_query.message.reply_text('❌ No file was downloaded')
-            else:
-                await update.message.reply_text('❌ No file was downloaded')
-            # Clean up download folder
-            try:
-                if os.path.exists(download_dir):
-                    shutil.rmtree(download_dir)
-                    print(f"Cleaned up download folder: {download_dir}")
-            except Exception as e:
-                print(f"Error cleaning up download folder {download_dir}: {str(e)}")
-            
+            # Send the video if it's small enough
+            update_job(job, stage='sending')
+            media = await probe_job_media(job, latest_file)
+            thumbnail = await make_thumbnail(
+                latest_file, thumbnail_time(media), os.path.splitext(latest_file)[0] + '.jpg'
+            )
+            if not await upload_video(bot, chat_id, latest_file, thumbnail=thumbnail, **video_attributes(media)):
+                await send_text(bot, chat_id, '❌ Error sending video. Please try again.')
+            # Clean up download folder after sending the video
+            cleanup_job_dir(job)
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # The bot is shutting down (or the loop is closing under us):
+        # keep the checkpoint and files for the next start
+        keep_checkpoint = True
+        raise
     except Exception as e:
-        if update.callback_query:
-            await update.callback_query.message.reply_text(f'❌ Error: {str(e)}')
-        else:
-            await update.message.reply_text(f'❌ Error: {str(e)}')
+        await send_text(bot, chat_id, f'❌ Error: {str(e)}')
         # Clean up download folder on error
-        try:
-            if os.path.exists(download_dir):
-                shutil.rmtree(download_dir)
-                print(f"Cleaned up download folder: {download_dir}")
-        except Exception as e:
-            print(f"Error cleaning up download folder {download_dir}: {str(e)}")
+        cleanup_job_dir(job)
     finally:
-        if downloaded_file and os.path.exists(downloaded_file):
-            try:
-                os.remove(downloaded_file)
-                print(f"Cleaned up: {downloaded_file}")
-            except Exception as e:
-                print(f"Error cleaning up file {downloaded_file}: {str(e)}")
-        
+        await release_disk_space(job)
+        if not keep_checkpoint:
+            finish_job(job)
+        active_downloads.pop(job['user_id'], None)
+
         if processing_msg:
+            scheduler.drop_status(processing_msg)
             try:
-                await processing_msg.delete()
+                await scheduler.call(processing_msg.chat_id, processing_msg.delete)
             except Exception as e:
-                print(f"Error deleting processing message: {str(e)}")
-        
+                logger.warning(f"Error deleting processing message: {str(e)}")
+
+async def download_video_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               format_id: str = None, start_time: str = None, end_time: str = None) -> None:
+    """Download video with specified options."""
+    url = context.args[0] if context.args else context.user_data.get('url')
+    if not url:
+        await reply(update, 'Please provide a YouTube URL')
+        return
+
+    processing_msg = context.user_data.get('status_msg')
+
+    try:
+        if not processing_msg:
+            processing_msg = await reply(update, '⏳ Starting download...')
+
+        job = await take_speculation(context, url, format_id, start_time, end_time, processing_msg)
+        if job is None:
+            job = create_job(
+                update.effective_chat.id, update.effective_user.id, url,
+                format_id, start_time, end_time
+            )
+        await run_job(context.bot, job, processing_msg)
+
+    except Exception as e:
+        await reply(update, f'❌ Error: {str(e)}')
+    finally:
         # Clean up status message from user_data
         context.user_data.pop('status_msg', None)
 
+# Jobs resumed at startup, cancelled again by stop_resumed_jobs
+resumed_tasks = set()
+
+async def resume_jobs(application: Application) -> None:
+    """Continue jobs that were interrupted by a restart from their last checkpoint."""
+    for job in load_pending_jobs():
+        try:
+            processing_msg = await scheduler.call(
+                job['chat_id'], application.bot.send_message,
+                job['chat_id'], '🔄 Bot restarted, resuming your download...'
+            )
+        except Exception as e:
+            logger.warning(f"Dropping job {job['job_id']}, chat unreachable: {str(e)}")
+            cleanup_job_dir(job)
+            finish_job(job)
+            continue
+        # post_init runs before Application.start(), so PTB would not track this task
+        task = asyncio.create_task(run_job(application.bot, job, processing_msg))
+        resumed_tasks.add(task)
+        task.add_done_callback(resumed_tasks.discard)
+
+async def stop_resumed_jobs(application: Application) -> None:
+    """Cancel resumed jobs on shutdown so they keep their checkpoints for the next start."""
+    tasks = list(resumed_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle direct URL messages."""
     url = update.message.text
     if 'youtube.com' in url or 'youtu.be' in url:
         try:
             # Get video info first
-            info = get_video_info(url)
+            index = await asyncio.to_thread(get_format_index, url)
             
-            # Find highest resolution format
-            formats = [f for f in info.get('formats', []) if f.get('height')]
-            if formats:
-                highest_format = max(formats, key=lambda x: x.get('height', 0))
-                format_id = highest_format.get('format_id')
-                resolution = highest_format.get('height')
-                fps = highest_format.get('fps')
+            # Video formats are sorted highest resolution first
+            if index['video']:
+                highest_format = index['video'][0]
+                format_id = highest_format['format_id']
+                resolution = highest_format['height']
+                fps = highest_format['fps']
                 
                 # Send info message
                 info_text = (
-                    f"📹 *{info.get('title', 'Video')}*\n\n"
+                    f"📹 *{index['title']}*\n\n"
                     f"Downloading in highest quality:\n"
                     f"🎥 {resolution}p{f' {fps}fps' if fps else ''}\n\n"
                     f"Use /quality or /format for other options"
                 )
-                await update.message.reply_text(info_text, parse_mode='Markdown')
+                await reply(update, info_text, parse_mode='Markdown')
                 
                 # Start download with highest quality
                 context.args = [url]
                 await download_video_command(update, context, format_id=format_id)
             else:
                 # If no video formats found, download best quality
-                await update.message.reply_text("🎥 Downloading in best available quality...")
+                await reply(update, "🎥 Downloading in best available quality...")
                 context.args = [url]
                 await download_video_command(update, context)
         except Exception as e:
-            await update.message.reply_text(f'❌ Error: {str(e)}')
+            await reply(update, f'❌ Error: {str(e)}')
 
 def main() -> None:
     """Start the bot."""
     # Create the Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder().token(TELEGRAM_TOKEN)
+        .post_init(resume_jobs)
+        .post_stop(stop_resumed_jobs)
+        .build()
+    )
 
     # Add conversation handler for clip command
     conv_handler = ConversationHandler(
@@ -686,6 +944,8 @@ def main() -> None:
     application.add_handler(CommandHandler("quality", quality_command))
     application.add_handler(CommandHandler("format", format_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(handle_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url))
@@ -0,0 +1,77 @@
+import pytest
+from clipper import plan_cut, plan_split, KEYFRAME_TOLERANCE
+
+# 29.97fps with a keyframe every 60 frames
+KEYFRAMES = [round(i * 2.002, 3) for i in range(10)]
+
+def test_range_inside_one_gop_is_encoded():
+    assert plan_cut(KEYFRAMES, 2.5, 3.5) == [('encode', 2.5, 3.5)]
+
+def test_boundaries_between_keyframes_are_encoded():
+    assert plan_cut(KEYFRAMES, 1.0, 9.0) == [
+        ('encode', 1.0, 2.002), ('copy', 2.002, 8.008), ('encode', 8.008, 9.0)
+    ]
+
+def test_start_just_before_keyframe_copies_from_the_keyframe():
+    pieces = plan_cut(KEYFRAMES, 2.0, 8.5)
+    assert pieces[0] == ('copy', 2.002, 8.008)
+    assert pieces[-1] == ('encode', 8.008, 8.5)
+
+def test_start_just_after_keyframe_copies_from_the_keyframe():
+    pieces = plan_cut(KEYFRAMES, 4.03, 8.5)
+    assert pieces[0] == ('copy', 4.004, 8.008)
+
+def test_copy_pieces_always_start_on_a_keyframe():
+    for start in (1.96, 1.99, 2.002, 2.01, 2.04):
+        for mode, piece_start, _ in plan_cut(KEYFRAMES, start, 12.0):
+            if mode == 'copy':
+                assert piece_start in KEYFRAMES
+
+def test_end_within_tolerance_of_keyframe_is_copied_to_the_end():
+    assert plan_cut(KEYFRAMES, 2.002, 8.03) == [('copy', 2.002, 8.03)]
+    assert plan_cut(KEYFRAMES, 2.002, 7.99) == [('copy', 2.002, 7.99)]
+
+def test_end_past_tolerance_is_encoded():
+    end = 8.008 + 2 * KEYFRAME_TOLERANCE
+    assert plan_cut(KEYFRAMES, 2.002, end) == [('copy', 2.002, 8.008), ('encode', 8.008, end)]
+
+@pytest.mark.parametrize('start, end', [(0.0, 18.018), (0.5, 17.0), (6.0, 6.1)])
+def test_pieces_are_contiguous(start, end):
+    pieces = plan_cut(KEYFRAMES, start, end)
+    for (_, _, a_end), (_, b_start, _) in zip(pieces, pieces[1:]):
+        assert a_end == b_start
+    assert pieces[-1][2] == end
+
+def _media(duration, keyframes):
+    return {'duration': duration, 'keyframes': keyframes}
+
+def test_small_file_is_one_part():
+    assert plan_split(_media(20.0, KEYFRAMES), 100, 200) == [[0.0, 20.0]]
+
+def test_split_points_are_keyframes():
+    media = _media(20.0, [i * 2.0 for i in range(10)])
+    # 9 seconds per part, so each part ends on the last keyframe before that
+    parts = plan_split(media, 100, 50)
+    assert parts == [[0.0, 8.0], [8.0, 16.0], [16.0, 20.0]]
+
+def test_gop_longer_than_a_part_is_kept_whole():
+    media = _media(30.0, [0.0, 12.0, 24.0])
+    # 4.5 seconds per part, but the only cut points are 12 seconds apart
+    assert plan_split(media, 100, 25) == [[0.0, 12.0], [12.0, 24.0], [24.0, 30.0]]
+
+def test_tail_shorter_than_tolerance_joins_the_last_part():
+    duration = 20.0 + KEYFRAME_TOLERANCE / 2
+    # About 9 seconds per part; the second one would end on the keyframe at 20
+    parts = plan_split(_media(duration, [0.0, 11.0, 20.0]), 100, 50)
+    assert parts == [[0.0, 11.0], [11.0, duration]]
+
+def test_parts_cover_the_whole_file():
+    media = _media(61.3, [i * 2.002 for i in range(31)])
+    parts = plan_split(media, 1000, 130)
+    assert parts[0][0] == 0.0 and parts[-1][1] == 61.3
+    for (_, a_end), (b_start, _) in zip(parts, parts[1:]):
+        assert a_end == b_start
+
+def test_without_keyframes_parts_are_equal_length():
+    parts = plan_split(_media(18.0, []), 100, 50)
+    assert [round(end - start, 6) for start, end in parts] == [8.1, 8.1, 1.8]
@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import contextlib
+import logging
+from telegram import InputFile
+from send_scheduler import scheduler, PRIORITY_DELIVERY
+from profiler import span
+
+logger = logging.getLogger(__name__)
+
+# How often RSS is sampled while an upload is running
+RSS_SAMPLE_INTERVAL = 0.25
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+async def _track_peak_rss(stats: dict) -> None:
+    while True:
+        stats['peak_rss'] = max(stats['peak_rss'], current_rss())
+        await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+async def upload_video(bot, chat_id: int, path: str, caption: str = None,
+                       max_retries: int = 3, thumbnail: str = None, **kwargs) -> bool:
+    """Upload a video from disk, streaming it instead of loading it into memory.
+
+    Every attempt opens its own handles (video and optional thumbnail) and
+    closes them before returning, so retries never leak descriptors and the
+    files can be removed right after. Extra kwargs (duration, width, height)
+    go to send_video.
+    """
+    size = os.path.getsize(path)
+    baseline = current_rss()
+    stats = {'peak_rss': baseline}
+    sampler = asyncio.create_task(_track_peak_rss(stats))
+    started = time.monotonic()
+
+    try:
+        with span('upload', file=os.path.basename(path), size=size):
+            for attempt in range(max_retries):
+                try:
+                    with contextlib.ExitStack() as files:
+                        f = files.enter_context(open(path, 'rb'))
+                        thumb = files.enter_context(open(thumbnail, 'rb')) if thumbnail else None
+
+                        async def send():
+                            # RetryAfter makes the scheduler call us again, so rewind first
+                            f.seek(0)
+                            if thumb:
+                                thumb.seek(0)
+                            return await bot.send_video(
+                                chat_id=chat_id,
+                                video=InputFile(f, filename=os.path.basename(path), read_file_handle=False),
+                                thumbnail=InputFile(thumb, filename='thumb.jpg') if thumb else None,
+                                caption=caption,
+                                supports_streaming=True,
+                                **kwargs
+                            )
+                        await scheduler.call(chat_id, send, priority=PRIORITY_DELIVERY)
+                    return True
+                except Exception as e:
+                    logger.warning(f"Error uploading {path} (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(2 ** attempt)  # Back off before retry
+            return False
+    finally:
+        sampler.cancel()
+        stats['peak_rss'] = max(stats['peak_rss'], current_rss())
+        logger.info(
+            f"Upload of {os.path.basename(path)} ({size/(1024*1024):.1f}MB) took "
+            f"{time.monotonic() - started:.1f}s, peak RSS {stats['peak_rss']/(1024*1024):.1f}MB "
+            f"(+{(stats['peak_rss'] - baseline)/(1024*1024):.1f}MB)"
+        )
@@ -4,19 +4,50 @@
 # 2) Downloader function:
 import os
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
 import datetime
 import sys
+import json
+import logging
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from clipper import smart_cut
+from media_probe import probe_media
+from ffmpeg_pool import ffmpeg_pool
+from profiler import span
+from log_setup import setup_logging, log_context, ytdlp_options, YtDlpLogger
+
+logger = logging.getLogger(__name__)
+
+# Best single file, preferably mp4
+DEFAULT_FORMAT = 'best[ext=mp4]/best'
 
 def format_duration(seconds: float) -> str:
     """Convert seconds to HH:MM:SS."""
     return str(datetime.timedelta(seconds=int(seconds)))
 
 def get_video_info(url: str) -> dict:
-    """Get video information including length and available formats."""
-    ydl_opts = {'quiet': True}
+    """Extract video information including length and available formats."""
+    ydl_opts = {'quiet': True, 'logger': YtDlpLogger()}
     with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-    
+        return ydl.extract_info(url, download=False)
+
+def resolve_video(url: str, format_id: str = None) -> dict:
+    """Extract a video and resolve the stream URLs of the format download_video would pick.
+
+    The result, saved as JSON, can be passed to download_video as `info_file`
+    so the download skips extraction.
+    """
+    ydl_opts = {'quiet': True, 'logger': YtDlpLogger(), 'format': format_id or DEFAULT_FORMAT}
+    with YoutubeDL(ydl_opts) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+def print_video_info(info: dict) -> None:
+    """Print video information and available formats to stdout."""
     # Print video information
     print("\n=== Video Information ===")
     print(f"Title: {info.get('title', 'Unknown')}")
@@ -35,11 +66,62 @@ def get_video_info(url: str) -> dict:
         res = f.get('height') or f.get('abr') or ''
         note = f.get('format_note', '')
         print(f"  [{tag:>5}]  {ext:<4}  @ {res:<4}   {note}")
+
+def convert_to_mp4(path: str) -> str:
+    """Make sure a download is an mp4, remuxing instead of re-encoding when the codecs allow it."""
+    if path.endswith('.mp4'):
+        return path
+
+    info = probe_media(path)
+    copy_video = not info['video'] or info['video'].get('codec_name') == 'h264'
+    copy_audio = not info['audio'] or info['audio'].get('codec_name') in ('aac', 'mp3')
+    output = os.path.splitext(path)[0] + '.mp4'
+    args = [
+        'ffmpeg', '-v', 'error', '-y', '-i', path,
+        '-c:v', 'copy' if copy_video else 'libx264',
+        '-c:a', 'copy' if copy_audio else 'aac',
+    ]
+    if not copy_audio:
+        args += ['-b:a', '192k']
+    args += ['-movflags', '+faststart', output]
+
+    logger.info(f"Converting {os.path.basename(path)} to mp4 "
+                f"({'remux' if copy_video and copy_audio else 'encode'})")
+    ffmpeg_pool.run_sync(args, encode=not (copy_video and copy_audio))
+    os.remove(path)
+    return output
+
+def finish_download(downloaded: list, start_time: str = None, end_time: str = None) -> bool:
+    """Check the downloaded file and cut the requested clip out of it.
+
+    Only files yt-dlp reported as finished are touched; leftovers such as
+    .part files and anything else in the folder are never converted or removed.
+    """
+    files = [f for f in downloaded if not f.endswith(('.part', '.ytdl')) and os.path.exists(f)]
+    if not files:
+        logger.error("No file was downloaded")
+        return False
+
+    latest_file = files[-1]
+    if os.path.getsize(latest_file) == 0:
+        logger.error("Downloaded file is empty or missing")
+        return False
     
-    return info
+    # Frame accurate clip: only the GOPs at the boundaries get re-encoded
+    if start_time or end_time:
+        logger.info(f"Cutting clip {start_time or 0}-{end_time or 'end'}")
+        with span('smart cut', start=start_time, end=end_time):
+            latest_file = smart_cut(latest_file, start_time, end_time)
+    else:
+        with span('convert to mp4'):
+            latest_file = convert_to_mp4(latest_file)
+        
+    logger.info(f"Download complete: {os.path.basename(latest_file)}")
+    return True
 
 def download_video(url: str, output_path: str = None, format_id: str = None, 
-                  start_time: str = None, end_time: str = None) -> bool:
+                  start_time: str = None, end_time: str = None, cancel_event=None,
+                  info_file: str = None) -> bool:
     """
     Download a video with optional clipping.
     
@@ -49,6 +131,8 @@ def download_video(url: str, output_path: str = None, format_id: str = None,
         format_id: Specific format ID to download
         start_time: Start time for clipping (HH:MM:SS or seconds)
         end_time: End time for clipping (HH:MM:SS or seconds)
+        cancel_event: threading.Event that aborts the download when set
+        info_file: JSON from resolve_video; its stream URLs are used instead of extracting again
     
     Returns:
         bool: True if download was successful, False otherwise
@@ -60,34 +144,35 @@ def download_video(url: str, output_path: str = None, format_id: str = None,
     
     # Build options
     ydl_opts = {
-        'format': format_id if format_id else 'best[ext=mp4]/best',
+        'format': format_id if format_id else DEFAULT_FORMAT,
         'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
         'merge_output_format': 'mp4',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }],
-        'postprocessor_args': [
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-b:a', '192k',
-            '-strict', 'experimental'
-        ],
+        # Conversion to mp4 happens in finish_download, through the shared ffmpeg pool
         # Add common options for better compatibility
         'nocheckcertificate': True,
+        # Keep .part files and resume them with HTTP range requests
+        'continuedl': True,
+        'nopart': False,
         'ignoreerrors': True,
-        'no_warnings': True,
-        'quiet': False,
-        'verbose': True
+        # Output goes through logging at the YTDLP_LOG_LEVEL level
+        **ytdlp_options()
     }
     
+    # Final path of every file yt-dlp finishes (after its own fixups)
+    downloaded = []
+    ydl_opts['post_hooks'] = [downloaded.append]
+    
+    # Abort from the progress hook once the caller gives up on this download
+    if cancel_event is not None:
+        def check_cancelled(progress):
+            if cancel_event.is_set():
+                raise DownloadCancelled('Download cancelled')
+        ydl_opts['progress_hooks'] = [check_cancelled]
+    
     # Add Instagram specific options
     if 'instagram.com' in url:
-        print("\n⚠️ For Instagram downloads, please follow these steps:")
-        print("1. Close all Chrome windows")
-        print("2. Open Chrome and log into Instagram")
-        print("3. Try downloading again")
-        print("\nIf you still get errors, try using Firefox instead.")
+        logger.info("Instagram download: a browser logged into Instagram (Firefox or Chrome) "
+                    "is needed for cookies")
         
         ydl_opts.update({
             'cookiesfrombrowser': ('firefox',),  # Try Firefox first
@@ -119,10 +204,10 @@ def download_video(url: str, output_path: str = None, format_id: str = None,
                     '--dump-json',
                     url
                 ], capture_output=True, check=True)
-                print("\n✅ Successfully loaded cookies from Firefox")
+                logger.info("Loaded Instagram cookies from Firefox")
             except:
                 # If Firefox fails, try Chrome
-                print("\n⚠️ Firefox cookies not found, trying Chrome...")
+                logger.info("Firefox cookies not found, trying Chrome")
                 subprocess.run([
                     'yt-dlp',
                     '--cookies-from-browser', 'chrome',
@@ -130,71 +215,36 @@ def download_video(url: str, output_path: str = None, format_id: str = None,
                     '--dump-json',
                     url
                 ], capture_output=True, check=True)
-                print("\n✅ Successfully loaded cookies from Chrome")
+                logger.info("Loaded Instagram cookies from Chrome")
             
             # Add cookies file to options
             ydl_opts['cookiefile'] = cookie_file
             
         except Exception as e:
-            print(f"\n⚠️ Error getting cookies: {str(e)}")
-            print("\nTrying without cookies...")
-            print("Note: Some Instagram videos may require authentication.")
-    
-    # Add clipping if specified
-    if start_time or end_time:
-        if not ydl_opts.get('postprocessor_args'):
-            ydl_opts['postprocessor_args'] = []
-        if start_time:
-            ydl_opts['postprocessor_args'].extend(['-ss', str(start_time)])
-        if end_time:
-            ydl_opts['postprocessor_args'].extend(['-to', str(end_time)])
+            logger.warning(f"Error getting cookies, trying without them "
+                           f"(some Instagram videos require authentication): {str(e)}")
     
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        
-        # Check if file was downloaded successfully
-        files = os.listdir(output_path)
-        if not files:
-            print("\n❌ No file was downloaded")
+        with span('yt-dlp download', format=ydl_opts['format']), YoutubeDL(ydl_opts) as ydl:
+            # With ignoreerrors, failures only show up in the return code
+            retcode = ydl.download_with_info_file(info_file) if info_file else ydl.download([url])
+        if retcode and info_file and not (cancel_event and cancel_event.is_set()):
+            # Resolved stream URLs may have expired: extract again
+            logger.warning("Download from resolved stream URLs failed, extracting again")
+            with YoutubeDL(ydl_opts) as ydl:
+                retcode = ydl.download([url])
+        if cancel_event is not None and cancel_event.is_set():
+            # Nobody wants the file any more: skip conversion and clipping
+            logger.info("Download cancelled")
             return False
-            
-        latest_file = max([os.path.join(output_path, f) for f in files], key=os.path.getctime)
-        if not os.path.exists(latest_file) or os.path.getsize(latest_file) == 0:
-            print("\n❌ Downloaded file is empty or missing")
+        if retcode:
+            logger.error(f"Download failed (yt-dlp exit code {retcode})")
             return False
-            
-        print("\n✅ Download complete!")
-        return True
+        
+        return finish_download(downloaded, start_time, end_time)
         
     except Exception as e:
-        print(f"\n❌ Error: {str(e)}", file=sys.stderr)
-        if "Postprocessing" in str(e):
-            print("\nTrying alternative download method...")
-            try:
-                # Try without post-processing
-                ydl_opts.pop('postprocessors', None)
-                ydl_opts.pop('postprocessor_args', None)
-                ydl_opts['format'] = 'best[ext=mp4]/best'
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-                
-                # Check if file was downloaded successfully
-                files = os.listdir(output_path)
-                if not files:
-                    print("\n❌ No file was downloaded")
-                    return False
-                    
-                latest_file = max([os.path.join(output_path, f) for f in files], key=os.path.getctime)
-                if not os.path.exists(latest_file) or os.path.getsize(latest_file) == 0:
-                    print("\n❌ Downloaded file is empty or missing")
-                    return False
-                    
-                print("\n✅ Download complete!")
-                return True
-            except Exception as e2:
-                print(f"\n❌ Error: {str(e2)}", file=sys.stderr)
-                return False
+        logger.error(f"Download failed: {str(e)}")
         return False
     finally:
         # Clean up temporary cookie file if it exists
@@ -204,7 +254,115 @@ def download_video(url: str, output_path: str = None, format_id: str = None,
             except:
                 pass
 
+def read_urls(args) -> list:
+    """Collect URLs from the command line and from --input (a file, or - for stdin)."""
+    urls = list(args.urls)
+    if args.input:
+        stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+        try:
+            for line in stream:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    urls.append(line)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    return urls
+
+def claim_output_path(directory: str, name: str) -> str:
+    """Reserve a file name no other item uses, adding ' (n)' before the extension if needed.
+
+    The name is claimed by creating an empty file, so parallel workers
+    finishing videos with the same title cannot pick the same path.
+    """
+    base, ext = os.path.splitext(name)
+    n = 0
+    while True:
+        path = os.path.join(directory, f'{base} ({n}){ext}' if n else name)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            n += 1
+
+def batch_download_one(url: str, args, item: int) -> dict:
+    """Download one batch item into its own scratch folder and move the result to --output."""
+    result = {'url': url, 'ok': False, 'path': None, 'size': None, 'elapsed': None, 'error': None}
+    started = time.monotonic()
+    # Workers share the output folder, so each one picks its file from a private folder
+    work_dir = tempfile.mkdtemp(prefix='.batch-', dir=args.output)
+    try:
+        with log_context(job_id=f'batch-{item}'):
+            success = download_video(url, work_dir, args.format, args.start, args.end)
+        if not success:
+            result['error'] = 'download failed'
+            return result
+
+        files = [os.path.join(work_dir, f) for f in os.listdir(work_dir)
+                 if not f.endswith(('.part', '.ytdl'))]
+        if not files:
+            result['error'] = 'no output file'
+            return result
+        latest_file = max(files, key=os.path.getctime)
+        path = claim_output_path(args.output, os.path.basename(latest_file))
+        try:
+            os.replace(latest_file, path)
+        except OSError:
+            os.remove(path)
+            raise
+        result.update(ok=True, path=os.path.abspath(path), size=os.path.getsize(path))
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        result['elapsed'] = round(time.monotonic() - started, 3)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+def batch_main(argv: list) -> int:
+    """Non-interactive mode: download many URLs in parallel, one JSON line per item.
+
+    Exit code is 0 when every item succeeded, 1 when some failed and 2 on
+    usage errors.
+    """
+    parser = argparse.ArgumentParser(description='Download videos in batch with yt-dlp.')
+    parser.add_argument('urls', nargs='*', help='video URLs')
+    parser.add_argument('-i', '--input', help='file with one URL per line, or - for stdin')
+    parser.add_argument('-f', '--format', help='format ID (default: best mp4)')
+    parser.add_argument('--start', help='clip start (HH:MM:SS or seconds)')
+    parser.add_argument('--end', help='clip end (HH:MM:SS or seconds)')
+    parser.add_argument('-o', '--output', default=os.getcwd(), help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='parallel downloads (default: 4)')
+    args = parser.parse_args(argv)
+
+    try:
+        urls = read_urls(args)
+    except OSError as e:
+        parser.error(f"can't read {args.input}: {e.strerror or e}")
+    if not urls:
+        parser.error('no URLs given')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    os.makedirs(args.output, exist_ok=True)
+
+    # stdout carries only JSON results; progress output goes to stderr
+    results_out = sys.stdout
+    failed = 0
+    with contextlib.redirect_stdout(sys.stderr):
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(batch_download_one, url, args, item) for item, url in enumerate(urls, 1)]
+            for future in as_completed(futures):
+                result = future.result()
+                failed += not result['ok']
+                results_out.write(json.dumps(result) + '\n')
+                results_out.flush()
+
+    return 1 if failed else 0
+
 def main():
+    setup_logging()
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+
     print("\n=== YouTube Video Downloader & Clipper ===")
     
     # Get URL
@@ -215,6 +373,7 @@ def main():
     
     # Get video info and formats
     info = get_video_info(url)
+    print_video_info(info)
     
     # Get format choice
     print("\n=== Download Options ===")